@@ -1,13 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import time
+_inicio_arranque = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context, g, jsonify, has_app_context, make_response
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right
+import csv
+import gzip
+import hashlib
+import io
+import json
 import os
-import cloudinary
-import cloudinary.uploader
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import struct
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 import secrets
+import socket
+import threading
+from busqueda import IndiceJugadores, normalizar
+from cache_fragmentos import CacheFragmentos, CacheLRU, crear_backend
+from reglas_nivel import variacion_y_puntos, aplicar_variacion
+from sorteo import generar_sorteo
+
+# Tiempos de arranque por fase (ver perfil_arranque.py)
+TIEMPOS_ARRANQUE = {'imports': time.perf_counter() - _inicio_arranque}
 
 app = Flask(__name__)
 
@@ -23,18 +41,116 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# SQLite (sin DATABASE_URL, en instalaciones pequeñas): en cada conexión, WAL para que las
+# lecturas no esperen a las escrituras ni al revés, commits sin fsync del WAL (con WAL
+# sigue siendo consistente ante un corte), espera en vez de error si la base está
+# bloqueada, y más caché. SQLITE_AJUSTES=off vuelve a los valores por defecto de SQLite;
+# journal_mode hay que ponerlo explícitamente porque WAL queda grabado en el fichero.
+# Comparativa: benchmark_sqlite.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # negativo: en KiB (20 MB)
+}
+if os.environ.get('SQLITE_AJUSTES', 'on') == 'off':
+    SQLITE_PRAGMAS = {'journal_mode': 'DELETE'}
+
+# Pool de conexiones por worker; configurable para compararlo con prueba_carga.py
+if os.environ.get('DB_POOL_SIZE'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ['DB_POOL_SIZE']),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    }
+
 db = SQLAlchemy(app)
 
-cloudinary.config(
-    cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.environ.get('CLOUDINARY_API_KEY'),
-    api_secret=os.environ.get('CLOUDINARY_API_SECRET')
+
+def _ajustar_sqlite(conexion, registro):
+    cursor = conexion.cursor()
+    for pragma, valor in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {valor}')
+    cursor.close()
+
+
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    with app.app_context():
+        db.event.listen(db.engine, 'connect', _ajustar_sqlite)
+
+# Caché de fragmentos de plantilla: memoria (por defecto), disco, redis u off
+app.jinja_env.add_extension(CacheFragmentos)
+app.jinja_env.cache_fragmentos = crear_backend(
+    os.environ.get('CACHE_FRAGMENTOS', 'memoria'),
+    directorio=os.environ.get('CACHE_FRAGMENTOS_DIR'),
+    url=os.environ.get('REDIS_URL'),
+    ttl=os.environ.get('CACHE_FRAGMENTOS_TTL')
 )
+# Cada club tiene sus propios fragmentos (club_id_actual se define con los modelos)
+app.jinja_env.cache_fragmentos_prefijo = lambda: f'club{club_id_actual()}'
+
+
+# Cloudinary y SendGrid solo se usan al subir foto y al enviar emails:
+# se importan la primera vez que hacen falta para no alargar el arranque
+@lru_cache(maxsize=None)
+def cloudinary_uploader():
+    import cloudinary
+    import cloudinary.uploader
+
+    cloudinary.config(
+        cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
+        api_key=os.environ.get('CLOUDINARY_API_KEY'),
+        api_secret=os.environ.get('CLOUDINARY_API_SECRET')
+    )
+    return cloudinary.uploader
+
+
+def sendgrid_cliente():
+    from sendgrid import SendGridAPIClient
+
+    return SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
 
 
 # ── MODELOS ──────────────────────────────────────────────────────────────────
 
-class Usuario(db.Model):
+CLUB_POR_DEFECTO = 1
+
+
+class Club(db.Model):
+    __tablename__ = 'clubes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    slug = db.Column(db.String(50), unique=True, nullable=False)
+    # Dominio propio del club (opcional); si no, se entra con ?club=<slug>
+    dominio = db.Column(db.String(120), unique=True, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Club {self.slug}>'
+
+
+def club_id_actual():
+    """Club de la petición en curso (o el fijado con en_club); fuera de ellas, el club por defecto."""
+    if has_app_context() and g.get('club_id') is not None:
+        return g.club_id
+    return CLUB_POR_DEFECTO
+
+
+class ConClub:
+    """Modelos con datos de un club. Todas sus consultas se filtran solas por el club actual (ver CLUBES)."""
+
+    @db.declared_attr
+    def club_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('clubes.id'), nullable=False, default=club_id_actual)
+
+
+class Usuario(ConClub, db.Model):
+    __table_args__ = (
+        db.Index('ix_usuario_club_ranking', 'club_id', 'puntos_ranking', 'id'),
+        db.Index('ix_usuario_club_indice', 'club_id', 'indice_club', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -52,7 +168,22 @@ class Usuario(db.Model):
     disponibilidad_horaria = db.Column(db.String(50), nullable=True)
     acepta_notificaciones = db.Column(db.Boolean, default=False)
     reset_token = db.Column(db.String(100), nullable=True)
+    reset_token_fecha = db.Column(db.DateTime, nullable=True)
     disponible_sustituciones = db.Column(db.Boolean, default=False)
+    # Nombre y email normalizados (sin acentos, en minúsculas) para el buscador de jugadores
+    busqueda = db.Column(db.String(250), nullable=True)
+    # Cambia con todo lo que se ve en sus páginas personales (ver respuesta_personal)
+    version_personal = db.Column(db.Integer, nullable=False, default=0)
+    # Número correlativo dentro del club (0, 1, 2...): su hueco en el índice inverso de los
+    # snapshots del ranking. Se asigna en guardar_snapshot_ranking
+    indice_club = db.Column(db.Integer, nullable=True)
+
+    @db.validates('nombre', 'email')
+    def _actualizar_busqueda(self, clave, valor):
+        nombre = valor if clave == 'nombre' else self.nombre
+        email = valor if clave == 'email' else self.email
+        self.busqueda = normalizar(f'{nombre or ""} {email or ""}')
+        return valor
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -64,8 +195,9 @@ class Usuario(db.Model):
         return self.categoria
 
 
-class Pozo(db.Model):
+class Pozo(ConClub, db.Model):
     __tablename__ = 'pozos'
+    __table_args__ = (db.Index('ix_pozos_club_fecha', 'club_id', 'activo', 'fecha'),)
 
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
@@ -80,8 +212,9 @@ class Pozo(db.Model):
         return f'<Pozo {self.titulo} (Nivel {self.nivel_min}-{self.nivel_max})>'
 
 
-class PozoJugado(db.Model):
+class PozoJugado(ConClub, db.Model):
     __tablename__ = 'pozos_jugados'
+    __table_args__ = (db.Index('ix_pozos_jugados_club_fecha', 'club_id', 'fecha'),)
 
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
@@ -95,22 +228,47 @@ class PozoJugado(db.Model):
         return f'<PozoJugado {self.titulo}>'
 
 
-class Resultado(db.Model):
+class Resultado(ConClub, db.Model):
     __tablename__ = 'resultados'
+    __table_args__ = (
+        db.Index('ix_resultados_club_email', 'club_id', 'email'),
+        db.Index('ix_resultados_club_pozo', 'club_id', 'pozo_jugado_id'),
+        # Sin AUTOINCREMENT, SQLite reutiliza los ids de las filas archivadas (ver con_archivo)
+        {'sqlite_autoincrement': True}
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    pozo_jugado_id = db.Column(db.Integer, db.ForeignKey('pozos_jugados.id'), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
+    pozo_jugado_id = db.Column(db.Integer, db.ForeignKey('pozos_jugados.id'), nullable=False, index=True)
+    email = db.Column(db.String(120), nullable=False, index=True)
     posicion = db.Column(db.Integer, nullable=True)
     puntos = db.Column(db.Integer, default=0)
+    # Número de pareja dentro del pozo: los dos jugadores de una pareja comparten valor
+    pareja = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<Resultado {self.email} - Pos {self.posicion}>'
 
 
-class HistorialNivel(db.Model):
+class EstadisticaCompanero(ConClub, db.Model):
+    __tablename__ = 'companeros'
+    __table_args__ = (db.Index('ix_companeros_club_email', 'club_id', 'email'),)
+
+    # Una fila por jugador y compañero (en los dos sentidos), acumulada en cada subida de resultados
+    email = db.Column(db.String(120), primary_key=True)
+    email_companero = db.Column(db.String(120), primary_key=True)
+    partidos = db.Column(db.Integer, nullable=False, default=0)
+    puntos = db.Column(db.Integer, nullable=False, default=0)
+    victorias = db.Column(db.Integer, nullable=False, default=0)
+    podios = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<EstadisticaCompanero {self.email} + {self.email_companero}: {self.partidos}>'
+
+
+class HistorialNivel(ConClub, db.Model):
     __tablename__ = 'historial_nivel'
+    __table_args__ = (db.Index('ix_historial_nivel_club_usuario', 'club_id', 'usuario_id'), {'sqlite_autoincrement': True})
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -123,8 +281,9 @@ class HistorialNivel(db.Model):
         return f'<HistorialNivel {self.usuario_id}: {self.nivel_anterior} -> {self.nivel_nuevo}>'
 
 
-class HistorialRanking(db.Model):
+class HistorialRanking(ConClub, db.Model):
     __tablename__ = 'historial_ranking'
+    __table_args__ = (db.Index('ix_historial_ranking_club_usuario', 'club_id', 'usuario_id'), {'sqlite_autoincrement': True})
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
@@ -137,6 +296,1423 @@ class HistorialRanking(db.Model):
         return f'<HistorialRanking {self.usuario_id}: pos {self.posicion}>'
 
 
+class SnapshotRanking(ConClub, db.Model):
+    __tablename__ = 'snapshots_ranking'
+    __table_args__ = (db.Index('ix_snapshots_ranking_club_fecha', 'club_id', 'fecha'), {'sqlite_autoincrement': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    pozo_jugado_id = db.Column(db.Integer, db.ForeignKey('pozos_jugados.id'), nullable=False, unique=True)
+    fecha = db.Column(db.DateTime, nullable=False, index=True)
+    total = db.Column(db.Integer, nullable=False)
+    # Ranking completo tras el pozo: ids en orden de clasificación y sus puntos (delta + zlib)
+    ids = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    puntos = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    # Índice inverso sin comprimir: 4 bytes por Usuario.indice_club con su puesto (0 = no estaba)
+    posiciones = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def ranking(self):
+        """Devuelve [(usuario_id, puntos), ...] en orden de clasificación."""
+        return list(zip(_desempaquetar(self.ids), _desacumular(_desempaquetar(self.puntos))))
+
+    def __repr__(self):
+        return f'<SnapshotRanking pozo {self.pozo_jugado_id}: {self.total} jugadores>'
+
+
+class EnvioNotificacion(ConClub, db.Model):
+    __tablename__ = 'envios_notificacion'
+    __table_args__ = (db.Index('ix_envios_notificacion_club_pozo', 'club_id', 'pozo_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    pozo_id = db.Column(db.Integer, db.ForeignKey('pozos.id', ondelete='CASCADE'), nullable=False, index=True)
+    estado = db.Column(db.String(20), default='pendiente')
+    total = db.Column(db.Integer, default=0)
+    enviados = db.Column(db.Integer, default=0)
+    fallidos = db.Column(db.Integer, default=0)
+    # Último destinatario (Usuario.id) ya procesado: si el envío se corta, se sigue desde ahí
+    ultimo_usuario_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<EnvioNotificacion pozo {self.pozo_id}: {self.enviados}/{self.total} {self.estado}>'
+
+
+class VersionDatos(db.Model):
+    __tablename__ = 'versiones_datos'
+
+    # Claves con el club delante ('1:ranking'): ver incrementar_version()
+    clave = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<VersionDatos {self.clave}: {self.version}>'
+
+
+class TareaProgramada(db.Model):
+    __tablename__ = 'tareas_programadas'
+
+    # Una fila por tarea: sirve de calendario y de bloqueo compartido entre workers
+    nombre = db.Column(db.String(50), primary_key=True)
+    ultima_ejecucion = db.Column(db.DateTime, nullable=True)
+    bloqueada_hasta = db.Column(db.DateTime, nullable=True)
+    propietario = db.Column(db.String(100), nullable=True)
+    ultimo_resultado = db.Column(db.String(200), nullable=True)
+
+    def __repr__(self):
+        return f'<TareaProgramada {self.nombre}: {self.ultima_ejecucion}>'
+
+
+class Temporada(ConClub, db.Model):
+    __tablename__ = 'temporadas'
+    __table_args__ = (db.Index('ix_temporadas_club_inicio', 'club_id', 'inicio'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(50), nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False, index=True)
+    fin = db.Column(db.DateTime, nullable=True)  # None = temporada en curso
+    archivada = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Temporada {self.nombre}>'
+
+
+# Tablas de archivo: mismas columnas que las originales más la temporada.
+# En Postgres están particionadas por temporada (una partición por temporada archivada);
+# en SQLite son tablas normales. La temporada forma parte de la clave primaria porque
+# Postgres lo exige en las tablas particionadas.
+
+class ResultadoArchivo(ConClub, db.Model):
+    __tablename__ = 'resultados_archivo'
+    __table_args__ = (
+        db.Index('ix_resultados_archivo_club_email', 'club_id', 'email'),
+        {'postgresql_partition_by': 'LIST (temporada_id)'}
+    )
+
+    temporada_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    pozo_jugado_id = db.Column(db.Integer, nullable=False, index=True)
+    email = db.Column(db.String(120), nullable=False, index=True)
+    posicion = db.Column(db.Integer, nullable=True)
+    puntos = db.Column(db.Integer, default=0)
+    pareja = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime)
+
+
+class HistorialNivelArchivo(ConClub, db.Model):
+    __tablename__ = 'historial_nivel_archivo'
+    __table_args__ = (
+        db.Index('ix_historial_nivel_archivo_club_usuario', 'club_id', 'usuario_id'),
+        {'postgresql_partition_by': 'LIST (temporada_id)'}
+    )
+
+    temporada_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    usuario_id = db.Column(db.Integer, nullable=False, index=True)
+    nivel_anterior = db.Column(db.Float, nullable=False)
+    nivel_nuevo = db.Column(db.Float, nullable=False)
+    pozo_jugado_id = db.Column(db.Integer, nullable=True)
+    fecha = db.Column(db.DateTime)
+
+
+class HistorialRankingArchivo(ConClub, db.Model):
+    __tablename__ = 'historial_ranking_archivo'
+    __table_args__ = (
+        db.Index('ix_historial_ranking_archivo_club_usuario', 'club_id', 'usuario_id'),
+        {'postgresql_partition_by': 'LIST (temporada_id)'}
+    )
+
+    temporada_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    usuario_id = db.Column(db.Integer, nullable=False, index=True)
+    posicion = db.Column(db.Integer, nullable=False)
+    puntos = db.Column(db.Integer, nullable=False)
+    pozo_jugado_id = db.Column(db.Integer, nullable=True)
+    fecha = db.Column(db.DateTime)
+
+
+class SnapshotRankingArchivo(ConClub, db.Model):
+    __tablename__ = 'snapshots_ranking_archivo'
+    __table_args__ = (
+        db.Index('ix_snapshots_ranking_archivo_club_fecha', 'club_id', 'fecha'),
+        {'postgresql_partition_by': 'LIST (temporada_id)'}
+    )
+
+    temporada_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    pozo_jugado_id = db.Column(db.Integer, nullable=False, index=True)
+    fecha = db.Column(db.DateTime, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    ids = db.Column(db.LargeBinary, nullable=False)
+    puntos = db.Column(db.LargeBinary, nullable=False)
+    posiciones = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime)
+
+
+class AnaliticaClub(ConClub, db.Model):
+    """Analítica del club ya calculada (JSON), una fila por club. Ver ANALÍTICA DEL CLUB."""
+    __tablename__ = 'analitica_club'
+    __table_args__ = (db.Index('ix_analitica_club_club', 'club_id', unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    datos = db.Column(db.Text, nullable=False)
+    # Versión 'ranking' con la que se calcularon los agregados de jugadores
+    version_ranking = db.Column(db.Integer, nullable=False, default=0)
+    actualizada = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnaliticaClub club {self.club_id}>'
+
+
+class ResumenTemporada(ConClub, db.Model):
+    __tablename__ = 'resumen_temporadas'
+
+    # Totales por jugador de cada temporada archivada, para no perder las estadísticas globales
+    email = db.Column(db.String(120), primary_key=True)
+    temporada_id = db.Column(db.Integer, db.ForeignKey('temporadas.id'), primary_key=True)
+    total_pozos = db.Column(db.Integer, nullable=False, default=0)
+    primeros = db.Column(db.Integer, nullable=False, default=0)
+    segundos = db.Column(db.Integer, nullable=False, default=0)
+    terceros = db.Column(db.Integer, nullable=False, default=0)
+    participaciones = db.Column(db.Integer, nullable=False, default=0)
+    puntos = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResumenTemporada {self.email} t{self.temporada_id}: {self.total_pozos} pozos>'
+
+
+# ── CLUBES ───────────────────────────────────────────────────────────────────
+# Varios clubes en el mismo despliegue y la misma base de datos. Cada petición fija
+# g.club_id (sesión, ?club=<slug> o dominio) y todas las consultas ORM sobre modelos
+# ConClub se filtran solas por ese club, incluidos updates, deletes y los alias de
+# con_archivo(). Sin club fijado (scripts, migraciones) se ve todo: los procesos en
+# segundo plano entran en cada club con en_club(). Para saltarse el filtro a propósito:
+# .execution_options(todos_los_clubes=True)
+
+_clubes = {}  # (campo, valor) -> (id, nombre); solo aciertos, los clubes no se borran
+_club_de_usuario = {}  # usuario_id -> club_id; un usuario no cambia nunca de club
+
+
+@contextmanager
+def en_club(club_id):
+    """Ejecuta el bloque como si la petición fuera del club indicado."""
+    anterior = g.get('club_id')
+    g.club_id = club_id
+    try:
+        yield
+    finally:
+        g.club_id = anterior
+
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def _filtrar_por_club(estado):
+    club_id = g.get('club_id') if has_app_context() else None
+    if club_id is None or estado.execution_options.get('todos_los_clubes'):
+        return
+    if estado.is_column_load or estado.is_relationship_load:
+        return
+    if estado.is_select or estado.is_update or estado.is_delete:
+        estado.statement = estado.statement.options(db.with_loader_criteria(
+            ConClub, lambda cls: cls.club_id == club_id, include_aliases=True
+        ))
+
+
+def _club_del_usuario(usuario_id):
+    if usuario_id not in _club_de_usuario:
+        club_id = db.session.query(Usuario.club_id).filter(Usuario.id == usuario_id)\
+            .execution_options(todos_los_clubes=True).scalar()
+        if club_id is None:
+            return None
+        _club_de_usuario[usuario_id] = club_id
+    return _club_de_usuario[usuario_id]
+
+
+def _buscar_club(campo, valor):
+    if (campo, valor) not in _clubes:
+        club = Club.query.filter(getattr(Club, campo) == valor).first()
+        if club is None:
+            return None
+        _clubes[(campo, valor)] = (club.id, club.nombre)
+    return _clubes[(campo, valor)]
+
+
+@app.before_request
+def fijar_club():
+    if request.endpoint == 'static':
+        return
+    # Con sesión iniciada manda siempre el club del usuario, sacado de su fila y no de la sesión
+    # ni de ?club= (las sesiones de antes de los clubes no llevan club_id); sin sesión, el del
+    # enlace, la visita anterior o el dominio
+    if 'user_id' in session:
+        club_id = _club_del_usuario(session['user_id'])
+        if club_id is not None:
+            if session.get('club_id') != club_id:
+                session['club_id'] = club_id
+            g.club_id = club_id
+            return
+    club_id = None
+    if request.args.get('club'):
+        club = _buscar_club('slug', request.args['club'])
+        if club:
+            club_id = session['club_id'] = club[0]
+    if club_id is None:
+        club_id = session.get('club_id')
+    if club_id is None:
+        club = _buscar_club('dominio', request.host.split(':')[0])
+        club_id = club[0] if club else CLUB_POR_DEFECTO
+    g.club_id = club_id
+
+
+@app.context_processor
+def inject_club_actual():
+    club = _buscar_club('id', club_id_actual())
+    return {'nombre_club': club[1] if club else 'La Pecera'}
+
+
+# ── UTILIDADES ───────────────────────────────────────────────────────────────
+
+def incrementar_version(*claves):
+    """Invalida lo cacheado que depende de estos datos. Se confirma con el commit del llamador."""
+    for clave in claves:
+        clave = f'{club_id_actual()}:{clave}'
+        actualizadas = VersionDatos.query.filter_by(clave=clave)\
+            .update({VersionDatos.version: VersionDatos.version + 1}, synchronize_session=False)
+        if not actualizadas:
+            db.session.add(VersionDatos(clave=clave, version=1))
+    g.pop('versiones_datos', None)
+
+
+def bloquear_ranking():
+    """Empieza la transacción de escritura del ranking del club actual, hasta el commit del llamador.
+
+    Su primera sentencia es el UPDATE de la versión 'ranking' del club: en SQLite toma el
+    bloqueo de escritura del fichero y en Postgres el de esa fila, así que las subidas y
+    borrados de pozos (y reconstruir_companeros) del mismo club van de uno en uno y lo que
+    leen después ya incluye lo que confirmó el anterior.
+    """
+    # Sin lecturas pendientes de otra transacción: en SQLite no se podría pasar a escritura
+    db.session.commit()
+    incrementar_version('ranking')
+    db.session.flush()
+
+
+def incrementar_version_personal(*usuarios):
+    """Invalida las páginas personales de estos usuarios. Se confirma con el commit del llamador."""
+    for usuario in usuarios:
+        if usuario is not None:
+            # En SQL (version_personal + 1) para no perder incrementos de peticiones simultáneas
+            usuario.version_personal = Usuario.version_personal + 1
+
+
+@app.template_global()
+def version_datos(clave):
+    # Una sola consulta por petición (y club) para todas las versiones
+    club_id = club_id_actual()
+    versiones = g.setdefault('versiones_datos', {})
+    if club_id not in versiones:
+        prefijo = f'{club_id}:'
+        versiones[club_id] = {c[len(prefijo):]: v for c, v in db.session.query(VersionDatos.clave, VersionDatos.version)
+                              .filter(VersionDatos.clave.like(f'{prefijo}%')).all()}
+    return versiones[club_id].get(clave, 0)
+
+
+def _empaquetar(valores):
+    return zlib.compress(struct.pack(f'<{len(valores)}i', *valores))
+
+
+def _desempaquetar(blob):
+    datos = zlib.decompress(blob)
+    return struct.unpack(f'<{len(datos) // 4}i', datos)
+
+
+def _desacumular(deltas):
+    valores, acumulado = [], 0
+    for delta in deltas:
+        acumulado += delta
+        valores.append(acumulado)
+    return valores
+
+
+def _indice_inverso(ids, indices):
+    """Puesto de cada jugador (ids en orden de clasificación) en su hueco indices[usuario_id]."""
+    posiciones = bytearray(4 * (max(indices.values()) + 1 if indices else 0))
+    for puesto, usuario_id in enumerate(ids, start=1):
+        if usuario_id in indices:
+            struct.pack_into('<I', posiciones, indices[usuario_id] * 4, puesto)
+    return bytes(posiciones)
+
+
+def guardar_snapshot_ranking(pozo_jugado, clasificacion=None):
+    """Guarda la clasificación completa del club tal y como queda tras un pozo.
+
+    clasificacion: [(usuario_id, puntos, indice_club), ...] ya actualizada, si el llamador la
+    tiene (subir_resultados la lee con el ranking ya bloqueado); si no, se lee ahora.
+    """
+    if clasificacion is None:
+        clasificacion = db.session.query(Usuario.id, Usuario.puntos_ranking, Usuario.indice_club).all()
+    filas = sorted(clasificacion, key=lambda f: (-(f[1] or 0), f[0]))
+
+    ids = [usuario_id for usuario_id, _, _ in filas]
+    puntos = [p or 0 for _, p, _ in filas]
+    # Los puntos van ordenados de mayor a menor: guardamos diferencias, que comprimen casi a cero
+    deltas = [b - a for a, b in zip([0] + puntos, puntos)]
+
+    # El índice inverso va por indice_club y no por id: los ids son de todos los clubes y
+    # un club pequeño creado después de uno grande tendría un índice enorme casi vacío
+    indices = {usuario_id: indice for usuario_id, _, indice in filas if indice is not None}
+    nuevos = sorted(usuario_id for usuario_id in ids if usuario_id not in indices)
+    if nuevos:
+        siguiente = max(indices.values(), default=-1) + 1
+        asignados = [{'id': usuario_id, 'indice_club': siguiente + n} for n, usuario_id in enumerate(nuevos)]
+        db.session.execute(db.update(Usuario), asignados, execution_options={'todos_los_clubes': True})
+        indices.update((a['id'], a['indice_club']) for a in asignados)
+
+    snapshot = SnapshotRanking(
+        pozo_jugado_id=pozo_jugado.id,
+        fecha=pozo_jugado.fecha,
+        total=len(ids),
+        ids=_empaquetar(ids),
+        puntos=_empaquetar(deltas),
+        posiciones=_indice_inverso(ids, indices)
+    )
+    db.session.add(snapshot)
+    return snapshot
+
+
+def historial_ranking_usuario(usuario, limite=20, archivo=False):
+    """Últimas posiciones del usuario en el ranking, una por pozo jugado en el club.
+
+    Solo se leen los 4 bytes del usuario dentro de cada snapshot.
+    """
+    usuario_id = usuario.id
+    filas = []
+    if usuario.indice_club is not None:
+        Snapshot = con_archivo(SnapshotRanking, archivo)
+        filas = db.session.query(
+            Snapshot.pozo_jugado_id,
+            Snapshot.fecha,
+            db.func.substr(Snapshot.posiciones, usuario.indice_club * 4 + 1, 4)
+        ).order_by(Snapshot.fecha.desc()).limit(limite).all()
+
+    historial = []
+    for pozo_jugado_id, fecha, trozo in filas:
+        if trozo and len(trozo) == 4:
+            posicion = struct.unpack('<I', bytes(trozo))[0]
+            if posicion:
+                historial.append({'pozo_jugado_id': pozo_jugado_id, 'fecha': fecha, 'posicion': posicion})
+
+    # Pozos anteriores a los snapshots: usamos las filas antiguas de historial_ranking
+    con_snapshot = {h['pozo_jugado_id'] for h in historial}
+    Ranking = con_archivo(HistorialRanking, archivo)
+    antiguos = db.session.query(Ranking).filter(Ranking.usuario_id == usuario_id)\
+        .order_by(Ranking.fecha.desc()).limit(limite).all()
+    for h in antiguos:
+        if h.pozo_jugado_id not in con_snapshot:
+            historial.append({'pozo_jugado_id': h.pozo_jugado_id, 'fecha': h.fecha, 'posicion': h.posicion})
+
+    historial.sort(key=lambda h: h['fecha'])
+    return historial[-limite:]
+
+
+def acumular_pareja(email1, email2, posicion, puntos, signo=1, filas=None):
+    """Suma (o resta, con signo=-1) un pozo jugado juntos al agregado de compañeros.
+
+    filas: {(email, email_companero): EstadisticaCompanero} ya cargadas; con él no se consulta
+    nada y las parejas que no están se dan por nuevas.
+    """
+    for email, companero in ((email1, email2), (email2, email1)):
+        if filas is not None:
+            fila = filas.get((email, companero))
+        else:
+            fila = db.session.get(EstadisticaCompanero, (email, companero))
+        if fila is None:
+            if signo < 0:
+                continue
+            fila = EstadisticaCompanero(email=email, email_companero=companero,
+                                        partidos=0, puntos=0, victorias=0, podios=0)
+            db.session.add(fila)
+            if filas is not None:
+                filas[(email, companero)] = fila
+        fila.partidos += signo
+        fila.puntos += signo * (puntos or 0)
+        fila.victorias += signo * (posicion == 1)
+        fila.podios += signo * (posicion in (1, 2, 3))
+        if fila.partidos <= 0:
+            db.session.delete(fila)
+
+
+def reconstruir_companeros():
+    """Recalcula desde cero el agregado de compañeros del club actual (ver en_club) a partir de resultados.
+
+    Con el ranking del club bloqueado (bloquear_ranking): una subida de resultados a la vez
+    espera a que termine en vez de sumar sobre filas que se están borrando.
+    """
+    bloquear_ranking()
+    EstadisticaCompanero.query.delete()
+    db.session.flush()
+    actual, anterior = None, None
+    R = con_archivo(Resultado, True)
+    for pozo_id, pareja, email, posicion, puntos in db.session.query(
+            R.pozo_jugado_id, R.pareja, R.email, R.posicion, R.puntos)\
+            .filter(R.pareja.isnot(None))\
+            .order_by(R.pozo_jugado_id, R.pareja, R.id):
+        if (pozo_id, pareja) == actual:
+            acumular_pareja(anterior, email, posicion, puntos)
+            actual = None
+        else:
+            actual, anterior = (pozo_id, pareja), email
+    db.session.commit()
+
+
+def _con_nombres(filas):
+    nombres = dict(db.session.query(Usuario.email, Usuario.nombre)
+                   .filter(Usuario.email.in_([f.email_companero for f in filas])).all())
+    return [{
+        'nombre': nombres.get(f.email_companero, f.email_companero),
+        'partidos': f.partidos,
+        'media_puntos': round(f.puntos / f.partidos, 1),
+        'victorias': f.victorias,
+        'podios': f.podios
+    } for f in filas]
+
+
+def companeros_frecuentes(email, limite=5):
+    filas = EstadisticaCompanero.query.filter_by(email=email)\
+        .order_by(EstadisticaCompanero.partidos.desc(), EstadisticaCompanero.puntos.desc())\
+        .limit(limite).all()
+    return _con_nombres(filas)
+
+
+def mejores_companeros(email, limite=5, minimo_partidos=2):
+    media = EstadisticaCompanero.puntos * 1.0 / EstadisticaCompanero.partidos
+    filas = EstadisticaCompanero.query.filter(
+        EstadisticaCompanero.email == email,
+        EstadisticaCompanero.partidos >= minimo_partidos
+    ).order_by(media.desc(), EstadisticaCompanero.partidos.desc()).limit(limite).all()
+    return _con_nombres(filas)
+
+
+def cara_a_cara(email, email_rival, archivo=False):
+    """Pozos que han coincidido dos jugadores y quién terminó por delante."""
+    R = con_archivo(Resultado, archivo)
+    mio, suyo = db.aliased(R), db.aliased(R)
+    filas = db.session.query(mio.posicion, suyo.posicion, mio.pareja, suyo.pareja)\
+        .join(suyo, suyo.pozo_jugado_id == mio.pozo_jugado_id)\
+        .filter(mio.email == email, suyo.email == email_rival).all()
+
+    balance = {'coincidencias': len(filas), 'juntos': 0, 'delante': 0, 'detras': 0, 'empates': 0}
+    for mi_posicion, su_posicion, mi_pareja, su_pareja in filas:
+        if mi_pareja is not None and mi_pareja == su_pareja:
+            balance['juntos'] += 1
+            continue
+        # Sin posición = fuera del podio, por detrás de cualquier puesto
+        a, b = mi_posicion or 99, su_posicion or 99
+        if a < b:
+            balance['delante'] += 1
+        elif a > b:
+            balance['detras'] += 1
+        else:
+            balance['empates'] += 1
+    return balance
+
+
+def movimientos_ranking(pozo_jugado_id, limite=10, archivo=False):
+    """Jugadores que más puestos han subido y bajado con un pozo respecto al anterior."""
+    Snapshot = con_archivo(SnapshotRanking, archivo)
+    actual = db.session.query(Snapshot.id, Snapshot.fecha, Snapshot.ids)\
+        .filter(Snapshot.pozo_jugado_id == pozo_jugado_id).first()
+    if not actual:
+        return [], []
+
+    def _anterior(Snapshot):
+        return db.session.query(Snapshot.ids).filter(Snapshot.fecha <= actual.fecha, Snapshot.id != actual.id)\
+            .order_by(Snapshot.fecha.desc(), Snapshot.id.desc()).first()
+
+    # El primer pozo de una temporada se compara con el último de la anterior, aunque esté archivada
+    anterior = _anterior(Snapshot) or (None if archivo else _anterior(con_archivo(SnapshotRanking, True)))
+    if not anterior:
+        return [], []
+
+    puestos_anteriores = {usuario_id: puesto for puesto, usuario_id in enumerate(_desempaquetar(anterior.ids), start=1)}
+    cambios = []
+    for puesto, usuario_id in enumerate(_desempaquetar(actual.ids), start=1):
+        puesto_anterior = puestos_anteriores.get(usuario_id)
+        if puesto_anterior and puesto_anterior != puesto:
+            cambios.append((puesto_anterior - puesto, usuario_id, puesto_anterior, puesto))
+
+    cambios.sort(key=lambda c: c[0], reverse=True)
+    subidas = [c for c in cambios if c[0] > 0][:limite]
+    bajadas = [c for c in reversed(cambios) if c[0] < 0][:limite]
+
+    nombres = dict(db.session.query(Usuario.id, Usuario.nombre)
+                   .filter(Usuario.id.in_([c[1] for c in subidas + bajadas])).all())
+
+    def _formatear(lista):
+        return [{
+            'nombre': nombres.get(usuario_id, '-'),
+            'puesto_anterior': puesto_anterior,
+            'puesto': puesto,
+            'diferencia': diferencia
+        } for diferencia, usuario_id, puesto_anterior, puesto in lista]
+
+    return _formatear(subidas), _formatear(bajadas)
+
+
+def filtrar_usuarios(query, filtros):
+    """Aplica los filtros de sustituciones del panel de admin a una query de Usuario."""
+    filtro_semana = filtros.get('disponibilidad_semana', '')
+    filtro_horario = filtros.get('disponibilidad_horaria', '')
+    filtro_ultima_hora = filtros.get('ultima_hora', '')
+    filtro_nivel_min = filtros.get('nivel_min', '')
+    filtro_nivel_max = filtros.get('nivel_max', '')
+
+    if filtro_semana:
+        query = query.filter(
+            (Usuario.disponibilidad_semana == filtro_semana) |
+            (Usuario.disponibilidad_semana == 'ambos')
+        )
+    if filtro_horario:
+        query = query.filter(Usuario.disponibilidad_horaria.contains(filtro_horario))
+    if filtro_ultima_hora:
+        query = query.filter(Usuario.disponible_sustituciones == True)
+    if filtro_nivel_min:
+        query = query.filter(Usuario.nivel_playtomic >= float(filtro_nivel_min))
+    if filtro_nivel_max:
+        query = query.filter(Usuario.nivel_playtomic <= float(filtro_nivel_max))
+    return query
+
+
+def _celda_csv(valor):
+    # Texto que empieza como una fórmula: con la comilla delante Excel lo muestra tal cual
+    if isinstance(valor, str) and valor[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + valor
+    return valor
+
+
+def respuesta_csv(nombre_archivo, cabecera, filas):
+    """Devuelve un CSV que se va generando fila a fila mientras se lee de la base de datos.
+
+    Lleva BOM UTF-8 para que Excel lo abra con tildes y eñes correctas, y los textos que
+    Excel tomaría por fórmulas (nombre, teléfono... los escribe cada socio) van con ' delante.
+    """
+    def generar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        buffer.write('\ufeff')
+        escritor.writerow(cabecera)
+        for fila in filas:
+            escritor.writerow([_celda_csv(valor) for valor in fila])
+            if buffer.tell() > 8192:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generar()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_archivo}"'}
+    )
+
+
+# ── TEMPORADAS ───────────────────────────────────────────────────────────────
+# Al archivar una temporada cerrada, sus resultados, historiales y snapshots del ranking pasan a las tablas
+# *_archivo y en las originales solo queda la temporada en curso. Las consultas leen
+# solo las tablas calientes salvo que pidan el archivo explícitamente (archivo=True)
+
+ARCHIVOS = {
+    Resultado: ResultadoArchivo,
+    HistorialNivel: HistorialNivelArchivo,
+    HistorialRanking: HistorialRankingArchivo,
+    SnapshotRanking: SnapshotRankingArchivo,
+}
+
+
+def con_archivo(modelo, archivo=False):
+    """El modelo tal cual o, con archivo=True, un alias que también lee su tabla de archivo.
+
+    El alias usa la identidad del modelo (su id): los ids no se repiten entre la tabla y su
+    archivo porque nunca se reutilizan (secuencias en Postgres, AUTOINCREMENT en SQLite).
+    """
+    if not archivo:
+        return modelo
+    tabla, archivada = modelo.__table__, ARCHIVOS[modelo].__table__
+    columnas = [c.name for c in tabla.c]
+    union = db.union_all(
+        db.select(*[tabla.c[n] for n in columnas]),
+        db.select(*[archivada.c[n] for n in columnas])
+    )
+    return db.aliased(modelo, union.subquery(f'{tabla.name}_todo'), adapt_on_names=True)
+
+
+def temporada_de(fecha):
+    return Temporada.query.filter(
+        Temporada.inicio <= fecha,
+        Temporada.fin.is_(None) | (Temporada.fin > fecha)
+    ).order_by(Temporada.inicio.desc()).first()
+
+
+def fecha_archivada(fecha):
+    temporada = temporada_de(fecha) if fecha else None
+    return bool(temporada and temporada.archivada)
+
+
+def hay_temporadas_archivadas():
+    return db.session.query(Temporada.id).filter_by(archivada=True).first() is not None
+
+
+def estadisticas_usuario(email):
+    """Pozos jugados y podios de siempre: temporada en curso más el resumen de las archivadas."""
+    def contar(columna, valor):
+        return db.func.coalesce(db.func.sum(db.case((columna == valor, 1), else_=0)), 0)
+
+    actual = db.session.query(
+        db.func.count(Resultado.id),
+        contar(Resultado.posicion, 1),
+        contar(Resultado.posicion, 2),
+        contar(Resultado.posicion, 3),
+        db.func.coalesce(db.func.sum(db.case((Resultado.posicion.is_(None), 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(Resultado.puntos), 0)
+    ).filter(Resultado.email == email).one()
+
+    archivado = db.session.query(
+        db.func.sum(ResumenTemporada.total_pozos),
+        db.func.sum(ResumenTemporada.primeros),
+        db.func.sum(ResumenTemporada.segundos),
+        db.func.sum(ResumenTemporada.terceros),
+        db.func.sum(ResumenTemporada.participaciones),
+        db.func.sum(ResumenTemporada.puntos)
+    ).filter(ResumenTemporada.email == email).one()
+
+    claves = ('total_pozos', 'primeros', 'segundos', 'terceros', 'participaciones', 'puntos')
+    return {clave: (a or 0) + (b or 0) for clave, a, b in zip(claves, actual, archivado)}
+
+
+def _crear_particiones(temporada_id):
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for modelo in ARCHIVOS.values():
+        tabla = modelo.__tablename__
+        db.session.execute(db.text(
+            f'CREATE TABLE IF NOT EXISTS {tabla}_t{int(temporada_id)} '
+            f'PARTITION OF {tabla} FOR VALUES IN ({int(temporada_id)})'
+        ))
+
+
+def _pozos_de_temporada(temporada):
+    # Filtro de club explícito: las copias al archivo leen las tablas directamente, sin el filtro del ORM
+    return db.select(PozoJugado.id).where(PozoJugado.club_id == temporada.club_id,
+                                          PozoJugado.fecha >= temporada.inicio, PozoJugado.fecha < temporada.fin)
+
+
+def _mover_al_archivo(modelo, temporada):
+    """Copia a su tabla de archivo las filas de la temporada y las borra de la original. Devuelve cuántas."""
+    condicion = modelo.pozo_jugado_id.in_(_pozos_de_temporada(temporada))
+    if modelo is not Resultado:
+        # Cambios de nivel/ranking sin pozo (p. ej. ajustes manuales) van por fecha
+        condicion = condicion | (modelo.pozo_jugado_id.is_(None) &
+                                 (modelo.fecha >= temporada.inicio) & (modelo.fecha < temporada.fin))
+    condicion = (modelo.club_id == temporada.club_id) & condicion
+    columnas = [c.name for c in modelo.__table__.c]
+    db.session.execute(db.insert(ARCHIVOS[modelo]).from_select(
+        ['temporada_id'] + columnas,
+        db.select(db.literal(temporada.id), *[modelo.__table__.c[n] for n in columnas]).where(condicion)
+    ))
+    borradas = db.session.execute(db.delete(modelo).where(condicion),
+                                  execution_options={'synchronize_session': False})
+    return borradas.rowcount
+
+
+def archivar_temporada(temporada):
+    """Mueve a las tablas de archivo todo lo de una temporada cerrada. Devuelve filas movidas por tabla."""
+    pozos = _pozos_de_temporada(temporada)
+    _crear_particiones(temporada.id)
+
+    # Resumen por jugador antes de mover nada, para que los totales de siempre no cambien
+    def contar(valor):
+        return db.func.sum(db.case((Resultado.posicion == valor, 1), else_=0))
+
+    db.session.execute(db.insert(ResumenTemporada).from_select(
+        ['club_id', 'email', 'temporada_id', 'total_pozos', 'primeros', 'segundos', 'terceros', 'participaciones', 'puntos'],
+        db.select(
+            db.literal(temporada.club_id), Resultado.email, db.literal(temporada.id), db.func.count(Resultado.id),
+            contar(1), contar(2), contar(3),
+            db.func.sum(db.case((Resultado.posicion.is_(None), 1), else_=0)),
+            db.func.coalesce(db.func.sum(Resultado.puntos), 0)
+        ).where(Resultado.pozo_jugado_id.in_(pozos)).group_by(Resultado.email)
+    ))
+
+    movidas = {modelo.__tablename__: _mover_al_archivo(modelo, temporada) for modelo in ARCHIVOS}
+
+    temporada.archivada = True
+    incrementar_version('temporadas')
+    db.session.commit()
+    return movidas
+
+
+# ── TAREAS PROGRAMADAS ───────────────────────────────────────────────────────
+# Mantenimiento periódico. Cada worker tiene un hilo que cada PLANIFICADOR_INTERVALO
+# segundos ejecuta las tareas vencidas; la fila de tareas_programadas hace de bloqueo,
+# así que cada tarea corre en un solo worker. Con PLANIFICADOR=off no se arranca el hilo
+# y se ejecutan desde fuera (tareas_programadas.py, p. ej. como cron job de Render)
+
+PLANIFICADOR_INTERVALO = int(os.environ.get('PLANIFICADOR_INTERVALO', 60))
+BLOQUEO_TAREA = timedelta(minutes=10)  # si un worker muere con la tarea a medias, otro la retoma
+CADUCIDAD_RESET_TOKEN = timedelta(hours=1)
+ENVIO_ABANDONADO = timedelta(minutes=5)  # sin avances en este tiempo, un envío de avisos se da por cortado
+
+
+def desactivar_pozos_caducados():
+    desactivados = 0
+    for club_id, in db.session.query(Club.id).all():
+        with en_club(club_id):
+            caducados = Pozo.query.filter(Pozo.activo == True, Pozo.fecha < datetime.utcnow())\
+                .update({Pozo.activo: False}, synchronize_session=False)
+            if caducados:
+                incrementar_version('pozos')
+            desactivados += caducados
+    db.session.commit()
+    return f'{desactivados} pozos desactivados'
+
+
+def limpiar_reset_tokens():
+    limite = datetime.utcnow() - CADUCIDAD_RESET_TOKEN
+    limpiados = Usuario.query.filter(
+        Usuario.reset_token.isnot(None),
+        Usuario.reset_token_fecha.is_(None) | (Usuario.reset_token_fecha < limite)
+    ).update({Usuario.reset_token: None, Usuario.reset_token_fecha: None}, synchronize_session=False)
+    db.session.commit()
+    return f'{limpiados} tokens caducados eliminados'
+
+
+def reanudar_notificaciones():
+    # Envíos sin avances desde hace rato: el hilo que los llevaba ya no existe
+    limite = datetime.utcnow() - ENVIO_ABANDONADO
+    abandonados = db.session.query(EnvioNotificacion.id, EnvioNotificacion.club_id).filter(
+        EnvioNotificacion.estado.in_(('pendiente', 'enviando')),
+        EnvioNotificacion.updated_at < limite
+    ).all()
+    for envio_id, club_id in abandonados:
+        with en_club(club_id):
+            enviar_notificaciones_pozo(envio_id)
+    return f'{len(abandonados)} envíos de notificaciones reanudados'
+
+
+def refrescar_agregados():
+    clubes = [club_id for club_id, in db.session.query(Club.id).all()]
+    for club_id in clubes:
+        with en_club(club_id):
+            reconstruir_companeros()
+    return f'agregado de compañeros recalculado en {len(clubes)} clubes'
+
+
+def purgar_fragmentos():
+    # Solo la caché en disco guarda lo caducado; en memoria se descarta solo y redis lo expira
+    backend = app.jinja_env.cache_fragmentos
+    if not hasattr(backend, 'purgar'):
+        return 'nada que purgar'
+    return f'{backend.purgar()} fragmentos caducados borrados'
+
+
+# nombre: (cada cuántos segundos, función)
+TAREAS = {
+    'desactivar_pozos': (15 * 60, desactivar_pozos_caducados),
+    'limpiar_tokens': (60 * 60, limpiar_reset_tokens),
+    'reanudar_notificaciones': (5 * 60, reanudar_notificaciones),
+    'purgar_fragmentos': (60 * 60, purgar_fragmentos),
+    'refrescar_agregados': (24 * 60 * 60, refrescar_agregados),
+}
+
+
+def _reservar_tarea(nombre, intervalo, propietario, forzar=False):
+    """Intenta quedarse con la tarea. Un único UPDATE condicional: solo un worker lo consigue."""
+    if db.session.get(TareaProgramada, nombre) is None:
+        try:
+            db.session.add(TareaProgramada(nombre=nombre))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()  # otro worker la ha creado a la vez
+
+    ahora = datetime.utcnow()
+    condicion = (TareaProgramada.nombre == nombre) & \
+        (TareaProgramada.bloqueada_hasta.is_(None) | (TareaProgramada.bloqueada_hasta < ahora))
+    if not forzar:
+        condicion &= TareaProgramada.ultima_ejecucion.is_(None) | \
+            (TareaProgramada.ultima_ejecucion <= ahora - timedelta(seconds=intervalo))
+
+    reservadas = TareaProgramada.query.filter(condicion).update({
+        TareaProgramada.bloqueada_hasta: ahora + BLOQUEO_TAREA,
+        TareaProgramada.propietario: propietario
+    }, synchronize_session=False)
+    db.session.commit()
+    return reservadas == 1
+
+
+def ejecutar_tareas(nombres=None, forzar=False):
+    """Ejecuta las tareas vencidas (o solo las indicadas). Devuelve {nombre: resultado} de las ejecutadas."""
+    propietario = f'{socket.gethostname()}:{os.getpid()}'
+    ejecutadas = {}
+    for nombre, (intervalo, funcion) in TAREAS.items():
+        if nombres and nombre not in nombres:
+            continue
+        if not _reservar_tarea(nombre, intervalo, propietario, forzar):
+            continue
+        try:
+            resultado = funcion()
+        except Exception as e:
+            db.session.rollback()
+            resultado = f'error: {e}'
+        TareaProgramada.query.filter_by(nombre=nombre).update({
+            TareaProgramada.ultima_ejecucion: datetime.utcnow(),
+            TareaProgramada.bloqueada_hasta: None,
+            TareaProgramada.ultimo_resultado: resultado[:200]
+        }, synchronize_session=False)
+        db.session.commit()
+        ejecutadas[nombre] = resultado
+    return ejecutadas
+
+
+_planificador = None
+_planificador_lock = threading.Lock()
+
+
+def _bucle_planificador():
+    while True:
+        time.sleep(PLANIFICADOR_INTERVALO)
+        try:
+            with app.app_context():
+                for nombre, resultado in ejecutar_tareas().items():
+                    print(f"🕒 {nombre}: {resultado}")
+        except Exception as e:
+            print(f"Error planificador: {e}")
+
+
+@app.before_request
+def iniciar_planificador():
+    # Se arranca con la primera petición y no al importar, para que los scripts que
+    # importan app (hacer_admin.py, simulador_reglas.py...) no lancen el hilo
+    global _planificador
+    if _planificador is not None or app.testing or os.environ.get('PLANIFICADOR', 'on') == 'off':
+        return
+    with _planificador_lock:
+        if _planificador is None:
+            _planificador = threading.Thread(target=_bucle_planificador, name='planificador', daemon=True)
+            _planificador.start()
+
+
+# ── BÚSQUEDA DE JUGADORES ────────────────────────────────────────────────────
+# Postgres: LIKE + word_similarity sobre Usuario.busqueda con índice GIN (pg_trgm).
+# SQLite: índice en memoria de busqueda.py, que se reconstruye cuando cambia la versión
+# 'usuarios' (registro y perfil la incrementan), así que cada worker lo tiene al día.
+# Hay un índice por club.
+# Reconstruirlo con decenas de miles de socios lleva un par de segundos: se hace en
+# segundo plano y mientras tanto se sigue buscando con el anterior
+
+BUSQUEDA_LIMITE = 10
+
+_indices_jugadores = {}  # club_id -> {'version', 'indice', 'reconstruyendo'}
+_indice_jugadores_lock = threading.Lock()
+
+
+def _reconstruir_indice(club_id, version):
+    estado = _indices_jugadores[club_id]
+    try:
+        with app.app_context(), en_club(club_id):
+            indice = IndiceJugadores(db.session.query(Usuario.id, Usuario.nombre, Usuario.email).all())
+        with _indice_jugadores_lock:
+            estado.update(version=version, indice=indice)
+    finally:
+        estado['reconstruyendo'] = False
+
+
+def _indice_en_memoria():
+    club_id = club_id_actual()
+    version = version_datos('usuarios')
+    with _indice_jugadores_lock:
+        estado = _indices_jugadores.setdefault(club_id, {'version': None, 'indice': None, 'reconstruyendo': False})
+        actual = estado['indice']
+        if estado['version'] == version:
+            return actual
+        if actual is not None:
+            if not estado['reconstruyendo']:
+                estado['reconstruyendo'] = True
+                threading.Thread(target=_reconstruir_indice, args=(club_id, version), daemon=True).start()
+            return actual
+
+    # Primera búsqueda del club en este worker: no hay índice anterior, toca esperar
+    _reconstruir_indice(club_id, version)
+    return estado['indice']
+
+
+def _buscar_postgres(texto, limite):
+    escapado = texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    coincide = Usuario.busqueda.like(f'%{escapado}%', escape='\\')
+    orden = [Usuario.busqueda.like(f'{escapado}%', escape='\\').desc()]
+    if app.config.get('BUSQUEDA_TRIGRAMAS'):
+        # busqueda %> texto equivale a word_similarity(texto, busqueda) >= umbral y usa el índice
+        coincide = coincide | Usuario.busqueda.op('%>')(texto)
+        orden.append(db.func.word_similarity(texto, Usuario.busqueda).desc())
+    return Usuario.query.filter(coincide).order_by(*orden, Usuario.nombre).limit(limite).all()
+
+
+def buscar_usuarios(consulta, limite=BUSQUEDA_LIMITE):
+    """Jugadores cuyo nombre o email encaja con la consulta, sin tener en cuenta acentos."""
+    texto = normalizar(consulta)
+    if not texto:
+        return []
+    if db.engine.dialect.name == 'postgresql':
+        return _buscar_postgres(texto, limite)
+
+    ids = _indice_en_memoria().buscar(texto, limite)
+    usuarios = {u.id: u for u in Usuario.query.filter(Usuario.id.in_(ids))}
+    return [usuarios[i] for i in ids if i in usuarios]
+
+
+# ── ANALÍTICA DEL CLUB ───────────────────────────────────────────────────────
+# Distribución de niveles, categorías, concentración de puntos, jugadores activos por
+# mes y asistencia a los pozos. Todo sale de agregados SQL (nunca se cargan todos los
+# Usuario ni Resultado) y se guarda ya calculado en analitica_club:
+# - al subir un pozo solo se recalculan su mes y su asistencia (actualizar_analitica)
+# - los agregados de jugadores se rehacen cuando cambia la versión 'ranking'
+# - borrar o editar un pozo jugado invalida la fila y se recalcula entera al consultarla
+
+ANALITICA_POZOS_RECIENTES = 26
+
+
+def _tramo_nivel(columna):
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.floor(columna * 2)
+    return db.cast(columna * 2, db.Integer)  # SQLite no siempre tiene floor(); los niveles no son negativos
+
+
+def _mes(columna):
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.to_char(columna, 'YYYY-MM')
+    return db.func.strftime('%Y-%m', columna)
+
+
+def _analitica_jugadores():
+    tramo = _tramo_nivel(db.func.coalesce(Usuario.nivel_playtomic, 0)).label('tramo')
+    niveles = [{'desde': t / 2, 'hasta': t / 2 + 0.5, 'jugadores': n} for t, n in
+               db.session.query(tramo, db.func.count(Usuario.id)).group_by(tramo).order_by(tramo)]
+
+    categoria = db.func.coalesce(Usuario.categoria, 'Sin categoría')
+    categorias = [{'categoria': c, 'jugadores': n} for c, n in
+                  db.session.query(categoria, db.func.count(Usuario.id))
+                  .group_by(categoria).order_by(db.func.count(Usuario.id).desc())]
+
+    # Concentración: qué parte de los puntos tiene el 10% de jugadores con más puntos
+    con_puntos, total = db.session.query(
+        db.func.count(Usuario.id), db.func.coalesce(db.func.sum(Usuario.puntos_ranking), 0)
+    ).filter(Usuario.puntos_ranking > 0).one()
+    mejores = db.session.query(Usuario.puntos_ranking.label('puntos')).filter(Usuario.puntos_ranking > 0)\
+        .order_by(Usuario.puntos_ranking.desc()).limit(max(1, -(-con_puntos // 10))).subquery()
+    puntos_mejores = db.session.query(db.func.coalesce(db.func.sum(mejores.c.puntos), 0)).scalar()
+
+    return {
+        'jugadores': sum(n['jugadores'] for n in niveles),
+        'niveles': niveles,
+        'categorias': categorias,
+        'puntos': {'total': total, 'jugadores_con_puntos': con_puntos,
+                   'cuota_top_10': round(puntos_mejores / total, 3) if total else 0},
+    }
+
+
+def _actividad_mensual(desde=None, hasta=None):
+    R = con_archivo(Resultado, True)
+    mes = _mes(PozoJugado.fecha).label('mes')
+    consulta = db.session.query(
+        mes, db.func.count(db.distinct(PozoJugado.id)), db.func.count(R.id), db.func.count(db.distinct(R.email))
+    ).join(R, R.pozo_jugado_id == PozoJugado.id)
+    if desde is not None:
+        consulta = consulta.filter(PozoJugado.fecha >= desde, PozoJugado.fecha < hasta)
+    return [{'mes': m, 'pozos': pozos, 'participaciones': participaciones, 'activos': activos}
+            for m, pozos, participaciones, activos in consulta.group_by(mes).order_by(mes)]
+
+
+def _asistencia(pozo_jugado_id=None):
+    R = con_archivo(Resultado, True)
+    consulta = db.session.query(PozoJugado.id, PozoJugado.titulo, PozoJugado.fecha, db.func.count(R.id))\
+        .join(R, R.pozo_jugado_id == PozoJugado.id)\
+        .group_by(PozoJugado.id, PozoJugado.titulo, PozoJugado.fecha)
+    if pozo_jugado_id is not None:
+        consulta = consulta.filter(PozoJugado.id == pozo_jugado_id)
+    else:
+        consulta = consulta.order_by(PozoJugado.fecha.desc(), PozoJugado.id.desc()).limit(ANALITICA_POZOS_RECIENTES)
+    return [{'id': i, 'titulo': titulo, 'fecha': fecha.strftime('%Y-%m-%d') if fecha else None, 'jugadores': n}
+            for i, titulo, fecha, n in consulta]
+
+
+def _guardar_analitica(fila, datos):
+    # Sin autoflush: la fila se escribe de una vez, en el commit
+    with db.session.no_autoflush:
+        fila.datos = json.dumps(datos)
+        fila.version_ranking = version_datos('ranking')
+    fila.actualizada = datetime.utcnow()
+
+
+def recalcular_analitica():
+    """Calcula desde cero la analítica del club actual. Se confirma con el commit del llamador."""
+    R = con_archivo(Resultado, True)
+    pozos, participaciones = db.session.query(db.func.count(db.distinct(R.pozo_jugado_id)), db.func.count(R.id)).one()
+    datos = {
+        **_analitica_jugadores(),
+        'meses': _actividad_mensual(),
+        'asistencia': sorted(_asistencia(), key=lambda p: (p['fecha'] or '', p['id'])),
+        'totales': {'pozos': pozos, 'participaciones': participaciones},
+    }
+    fila = AnaliticaClub.query.first()
+    if fila is None:
+        fila = AnaliticaClub()
+        db.session.add(fila)
+    _guardar_analitica(fila, datos)
+    return fila
+
+
+def actualizar_analitica(pozo_jugado):
+    """Incorpora un pozo recién subido sin recalcular el resto del historial."""
+    # En Postgres, dos subidas a la vez se esperan aquí; en SQLite la segunda falla al escribir
+    fila = AnaliticaClub.query.with_for_update().first()
+    if fila is None:
+        return  # se calculará entera la primera vez que alguien la consulte
+    datos = json.loads(fila.datos)
+    datos.update(_analitica_jugadores())
+
+    inicio = pozo_jugado.fecha.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    meses = {m['mes']: m for m in datos['meses']}
+    meses.update({m['mes']: m for m in _actividad_mensual(inicio, (inicio + timedelta(days=32)).replace(day=1))})
+    datos['meses'] = sorted(meses.values(), key=lambda m: m['mes'])
+
+    nuevo = _asistencia(pozo_jugado.id)
+    datos['totales']['pozos'] += len(nuevo)
+    datos['totales']['participaciones'] += sum(p['jugadores'] for p in nuevo)
+    datos['asistencia'] = sorted(datos['asistencia'] + nuevo,
+                                 key=lambda p: (p['fecha'] or '', p['id']))[-ANALITICA_POZOS_RECIENTES:]
+    _guardar_analitica(fila, datos)
+
+
+def invalidar_analitica():
+    AnaliticaClub.query.delete(synchronize_session=False)
+
+
+def analitica_club():
+    """(datos, fecha de cálculo) de la analítica del club actual, recalculando lo que haga falta."""
+    fila = AnaliticaClub.query.first()
+    if fila is not None and fila.version_ranking == version_datos('ranking'):
+        return json.loads(fila.datos), fila.actualizada
+
+    if fila is None:
+        fila = recalcular_analitica()
+    else:
+        # Solo han cambiado jugadores (registros, niveles, puntos): sus agregados son baratos
+        datos = json.loads(fila.datos)
+        datos.update(_analitica_jugadores())
+        _guardar_analitica(fila, datos)
+    datos, actualizada = json.loads(fila.datos), fila.actualizada
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()  # otro worker la ha guardado a la vez; la suya vale igual
+    return datos, actualizada
+
+
+# ── NOTIFICACIONES ───────────────────────────────────────────────────────────
+
+# SendGrid admite hasta 1000 personalizations por petición
+NOTIFICACIONES_LOTE = int(os.environ.get('NOTIFICACIONES_LOTE', 500))
+NOTIFICACIONES_PAUSA = float(os.environ.get('NOTIFICACIONES_PAUSA', 1.0))
+
+
+def _enviar_lote_sendgrid(destinatarios, asunto, html):
+    from sendgrid.helpers.mail import Mail, To
+
+    mensaje = Mail(
+        from_email=os.environ.get('SENDGRID_FROM_EMAIL'),
+        to_emails=[To(email, nombre, substitutions={'-nombre-': nombre}) for email, nombre in destinatarios],
+        subject=asunto,
+        html_content=html,
+        is_multiple=True
+    )
+    sendgrid_cliente().send(mensaje)
+
+
+def _enviar_lote_local(destinatarios, asunto, html):
+    print(f"📧 [{asunto}] → {len(destinatarios)} destinatarios: {', '.join(e for e, _ in destinatarios[:5])}...")
+
+
+def transporte_notificaciones():
+    transporte = os.environ.get('NOTIFICACIONES_TRANSPORTE')
+    if transporte == 'sendgrid' or (transporte is None and os.environ.get('SENDGRID_API_KEY')):
+        return _enviar_lote_sendgrid
+    return _enviar_lote_local
+
+
+def email_nuevo_pozo(pozo):
+    app_url = os.environ.get('APP_URL', 'http://localhost:5001')
+    fecha = pozo.fecha.strftime('%d/%m/%Y %H:%M') if pozo.fecha else 'Fecha por confirmar'
+    club = _buscar_club('id', pozo.club_id)
+    nombre_club = club[1] if club else 'La Pecera'
+    asunto = f'Nuevo pozo: {pozo.titulo} - {nombre_club} Padel Hub'
+    html = f'''
+    <div style="font-family: Arial, sans-serif; max-width: 500px; margin: auto;">
+        <h2 style="color: #10b981;">🎾 {nombre_club} Padel Hub</h2>
+        <p>Hola <strong>-nombre-</strong>,</p>
+        <p>Hay un nuevo pozo para tu nivel:</p>
+        <p><strong>{pozo.titulo}</strong><br>{fecha} · Nivel {pozo.nivel_min} - {pozo.nivel_max}</p>
+        <p>
+            <a href="{pozo.enlace}" style="background:#10b981;color:white;padding:12px 24px;
+            border-radius:8px;text-decoration:none;font-weight:bold;">
+                Inscribirse
+            </a>
+        </p>
+        <p style="color:#999;font-size:12px;">
+            Recibes este email porque aceptaste notificaciones. Puedes desactivarlas en
+            <a href="{app_url}/perfil">tu perfil</a>.
+        </p>
+    </div>
+    '''
+    return asunto, html
+
+
+def enviar_notificaciones_pozo(envio_id, transporte=None):
+    """Envía el aviso de un pozo nuevo a todos los jugadores de su nivel, por lotes.
+
+    Si el envío ya estaba empezado, sigue por el primer destinatario sin procesar.
+    """
+    transporte = transporte or transporte_notificaciones()
+    envio = EnvioNotificacion.query.get(envio_id)
+    pozo = Pozo.query.get(envio.pozo_id) if envio else None
+    if not pozo or envio.estado not in ('pendiente', 'enviando'):
+        return
+
+    # Una sola query para todos los elegibles; solo columnas, sin objetos Usuario
+    destinatarios = db.session.query(Usuario.id, Usuario.email, Usuario.nombre).filter(
+        Usuario.club_id == pozo.club_id,
+        Usuario.acepta_notificaciones == True,
+        Usuario.nivel_playtomic >= pozo.nivel_min,
+        Usuario.nivel_playtomic <= pozo.nivel_max,
+        Usuario.id > (envio.ultimo_usuario_id or 0)
+    ).order_by(Usuario.id).all()
+
+    asunto, html = email_nuevo_pozo(pozo)
+    if envio.estado == 'pendiente':
+        envio.total = len(destinatarios)
+    envio.estado = 'enviando'
+    envio.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    for i in range(0, len(destinatarios), NOTIFICACIONES_LOTE):
+        lote = destinatarios[i:i + NOTIFICACIONES_LOTE]
+        try:
+            transporte([(email, nombre) for _, email, nombre in lote], asunto, html)
+            envio.enviados += len(lote)
+        except Exception as e:
+            envio.fallidos += len(lote)
+            envio.error = str(e)[:500]
+            print(f"Error notificaciones pozo {pozo.id}: {e}")
+        # Si el proceso muere antes de este commit, al reanudar se repite solo este lote
+        envio.ultimo_usuario_id = lote[-1][0]
+        db.session.commit()
+        if i + NOTIFICACIONES_LOTE < len(destinatarios):
+            time.sleep(NOTIFICACIONES_PAUSA)
+
+    envio.estado = 'error' if envio.fallidos and not envio.enviados else 'completado'
+    db.session.commit()
+
+
+def lanzar_notificaciones_pozo(pozo):
+    """Registra el envío y lo procesa en segundo plano para no bloquear la petición.
+
+    Si el worker se recicla a mitad, la tarea reanudar_notificaciones lo termina.
+    """
+    envio = EnvioNotificacion(pozo_id=pozo.id)
+    db.session.add(envio)
+    db.session.commit()
+    envio_id, club_id = envio.id, pozo.club_id
+
+    def _trabajo():
+        with app.app_context(), en_club(club_id):
+            try:
+                enviar_notificaciones_pozo(envio_id)
+            except Exception as e:
+                print(f"Error notificaciones: {e}")
+
+    threading.Thread(target=_trabajo, daemon=True).start()
+    return envio
+
+
+# ── ESTÁTICOS Y COMPRESIÓN ───────────────────────────────────────────────────
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/css', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+TAMANO_MINIMO_COMPRESION = 500
+_estaticos_comprimidos = {}
+
+
+@lru_cache(maxsize=None)
+def manifiesto_estaticos():
+    try:
+        with open(os.path.join(app.static_folder, 'dist', 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@app.template_global()
+def asset_url(nombre):
+    """URL del estático compilado con hash, o None si no se ha ejecutado construir_estaticos.py."""
+    fichero = manifiesto_estaticos().get(nombre)
+    return url_for('static', filename=f'dist/{fichero}') if fichero else None
+
+
+def _codificacion_aceptada():
+    aceptadas = request.headers.get('Accept-Encoding', '')
+    if brotli and 'br' in aceptadas:
+        return 'br'
+    if 'gzip' in aceptadas:
+        return 'gzip'
+    return None
+
+
+def _comprimir(datos, codificacion, maxima=False):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=11 if maxima else 5)
+    return gzip.compress(datos, compresslevel=9 if maxima else 6)
+
+
+@app.after_request
+def cachear_y_comprimir(response):
+    # Los ficheros de static/dist/ llevan el hash en el nombre: nunca cambian
+    estatico_inmutable = request.endpoint == 'static' and request.path.startswith('/static/dist/')
+    if estatico_inmutable and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+    codificacion = _codificacion_aceptada()
+    if (not codificacion or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if estatico_inmutable:
+        # Se comprime una sola vez con el nivel máximo y se guarda en memoria
+        clave = (request.path, codificacion)
+        if clave not in _estaticos_comprimidos:
+            response.direct_passthrough = False
+            _estaticos_comprimidos[clave] = _comprimir(response.get_data(), codificacion, maxima=True)
+        comprimido = _estaticos_comprimidos[clave]
+    else:
+        response.direct_passthrough = False
+        datos = response.get_data()
+        if len(datos) < TAMANO_MINIMO_COMPRESION:
+            return response
+        comprimido = _comprimir(datos, codificacion)
+
+    response.set_data(comprimido)
+    response.headers['Content-Encoding'] = codificacion
+    return response
+
+
+# ── PÁGINAS PERSONALES ───────────────────────────────────────────────────────
+# /dashboard, /pozos y /estadisticas solo cambian cuando cambian los datos del socio
+# (version_personal) o las versiones del club de las que dependen. Con eso se calcula un
+# ETag: si el navegador ya tiene esa versión recibe un 304, y si no, el HTML se guarda
+# un rato en memoria y la siguiente visita no toca la base de datos más que para
+# leer las versiones
+
+CACHE_PERSONAL_TTL = int(os.environ.get('CACHE_PERSONAL_TTL', 120))
+VERSION_DESPLIEGUE = os.environ.get('RENDER_GIT_COMMIT') or str(int(os.path.getmtime(__file__)))
+
+# Páginas enteras: se limita lo que ocupan en cada worker, no solo cuántas son
+_cache_personal = CacheLRU(max_entradas=int(os.environ.get('CACHE_PERSONAL_ENTRADAS', 500)),
+                           max_bytes=int(os.environ.get('CACHE_PERSONAL_MB', 8)) * 1024 * 1024)
+# club_id -> (versión 'pozos', fechas, niveles mínimos y niveles máximos, ordenados,
+# de los pozos activos que aún no han empezado)
+_pozos_pendientes = {}
+
+
+def _pozos_pendientes_club():
+    club_id, version = club_id_actual(), version_datos('pozos')
+    guardado = _pozos_pendientes.get(club_id)
+    if guardado is None or guardado[0] != version:
+        filas = db.session.query(Pozo.fecha, Pozo.nivel_min, Pozo.nivel_max)\
+            .filter(Pozo.activo == True, Pozo.fecha >= datetime.utcnow()).all()
+        guardado = _pozos_pendientes[club_id] = (
+            version,
+            sorted(f for f, _, _ in filas),
+            sorted(minimo for _, minimo, _ in filas if minimo is not None),
+            sorted(maximo for _, _, maximo in filas if maximo is not None)
+        )
+    return guardado
+
+
+def _proximo_pozo():
+    """Fecha del siguiente pozo que va a empezar: cuando pasa, deja de salir en 'próximos'."""
+    ahora = datetime.utcnow()
+    return next((f.isoformat() for f in _pozos_pendientes_club()[1] if f >= ahora), None)
+
+
+@app.template_global()
+def tramo_nivel(nivel):
+    """Tramo del nivel entre los límites de los pozos pendientes: con el mismo tramo salen los mismos pozos.
+
+    Cuenta los nivel_min que alcanza y los nivel_max que supera, así que sirve de clave de
+    caché en lugar del nivel exacto de cada jugador.
+    """
+    if nivel is None:
+        return None
+    _, _, minimos, maximos = _pozos_pendientes_club()
+    return f'{bisect_right(minimos, nivel)}-{bisect_left(maximos, nivel)}'
+
+
+def respuesta_personal(*claves, proximos_pozos=False):
+    """ETag y caché corta para una página personal que depende de estas versiones del club."""
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            # Con mensajes flash pendientes la página no es la de siempre
+            if 'user_id' not in session or session.get('_flashes'):
+                return vista(*args, **kwargs)
+            version_personal = db.session.query(Usuario.version_personal)\
+                .filter(Usuario.id == session['user_id']).scalar()
+            if version_personal is None:
+                return vista(*args, **kwargs)
+
+            # is_admin va en la sesión y cambia la navegación (base.html)
+            partes = [VERSION_DESPLIEGUE, club_id_actual(), session['user_id'], bool(session.get('is_admin')),
+                      version_personal, request.full_path, [version_datos(clave) for clave in claves]]
+            if proximos_pozos:
+                partes.append(_proximo_pozo())
+            etag = hashlib.sha1(repr(partes).encode()).hexdigest()
+
+            if request.if_none_match.contains_weak(etag):
+                respuesta = Response(status=304)
+            else:
+                html = _cache_personal.get(etag)
+                if html is not None:
+                    respuesta = make_response(html)
+                else:
+                    respuesta = make_response(vista(*args, **kwargs))
+                    if respuesta.status_code != 200:
+                        return respuesta
+                    _cache_personal.set(etag, respuesta.get_data(as_text=True), CACHE_PERSONAL_TTL)
+            respuesta.set_etag(etag, weak=True)
+            respuesta.headers['Cache-Control'] = 'private, no-cache'
+            return respuesta
+        return envoltura
+    return decorador
+
+
 # ── RUTAS ────────────────────────────────────────────────────────────────────
 
 @app.route('/')
@@ -152,9 +1728,11 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
 
-        usuario = Usuario.query.filter_by(email=email).first()
+        # El email es único en todo el despliegue: el usuario entra siempre en su club
+        usuario = Usuario.query.filter_by(email=email).execution_options(todos_los_clubes=True).first()
 
         if usuario and usuario.check_password(password):
+            session['club_id'] = usuario.club_id
             session['user_id'] = usuario.id
             session['user_name'] = usuario.nombre
             session['is_admin'] = usuario.es_admin
@@ -179,7 +1757,7 @@ def registro():
             flash('Debes aceptar los términos y condiciones', 'error')
             return redirect(url_for('registro'))
 
-        if Usuario.query.filter_by(email=email).first():
+        if Usuario.query.filter_by(email=email).execution_options(todos_los_clubes=True).first():
             flash('Este email ya está registrado', 'error')
             return redirect(url_for('registro'))
 
@@ -192,6 +1770,7 @@ def registro():
         nuevo_usuario.set_password(password)
 
         db.session.add(nuevo_usuario)
+        incrementar_version('ranking', 'usuarios')
         db.session.commit()
 
         flash('¡Registro exitoso! Ya puedes iniciar sesión', 'success')
@@ -201,6 +1780,7 @@ def registro():
 
 
 @app.route('/dashboard')
+@respuesta_personal('ranking', 'pozos', proximos_pozos=True)
 def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -208,39 +1788,29 @@ def dashboard():
     usuario = Usuario.query.get(session['user_id'])
     mi_nivel = usuario.nivel_playtomic
 
-    proximos_pozos = Pozo.query.filter(
-        Pozo.activo == True,
-        Pozo.nivel_min <= mi_nivel,
-        Pozo.nivel_max >= mi_nivel,
-        Pozo.fecha >= datetime.utcnow()
-    ).order_by(Pozo.fecha).limit(3).all()
-
-    usuarios_ranking = Usuario.query.order_by(Usuario.puntos_ranking.desc()).all()
-    mi_posicion = None
-    for i, u in enumerate(usuarios_ranking):
-        if u.id == usuario.id:
-            mi_posicion = i + 1
-            break
+    # Top 5 y próximos pozos son fragmentos cacheados: solo se consultan si hay que renderizarlos
+    def proximos_pozos():
+        return Pozo.query.filter(
+            Pozo.activo == True,
+            Pozo.nivel_min <= mi_nivel,
+            Pozo.nivel_max >= mi_nivel,
+            Pozo.fecha >= datetime.utcnow()
+        ).order_by(Pozo.fecha).limit(3).all()
 
-    top_ranking = usuarios_ranking[:5]
+    def top_ranking():
+        return Usuario.query.order_by(Usuario.puntos_ranking.desc(), Usuario.id).limit(5).all()
 
-    resultados = Resultado.query.filter_by(email=usuario.email).all()
-    total_pozos = len(resultados)
-    primeros = sum(1 for r in resultados if r.posicion == 1)
-    segundos = sum(1 for r in resultados if r.posicion == 2)
-    terceros = sum(1 for r in resultados if r.posicion == 3)
-    participaciones = sum(1 for r in resultados if r.posicion is None)
+    # Mismo orden que el ranking (puntos y, a igualdad, antigüedad) sin cargar a todos los usuarios
+    mi_posicion = Usuario.query.filter(
+        (Usuario.puntos_ranking > usuario.puntos_ranking) |
+        ((Usuario.puntos_ranking == usuario.puntos_ranking) & (Usuario.id < usuario.id))
+    ).count() + 1
 
-    stats = {
-        'total_pozos': total_pozos,
-        'primeros': primeros,
-        'segundos': segundos,
-        'terceros': terceros,
-        'participaciones': participaciones
-    }
+    stats = estadisticas_usuario(usuario.email)
 
     return render_template('dashboard_new.html',
                            proximos_pozos=proximos_pozos,
+                           mi_nivel=mi_nivel,
                            usuario=usuario,
                            mi_posicion=mi_posicion,
                            top_ranking=top_ranking,
@@ -248,6 +1818,7 @@ def dashboard():
 
 
 @app.route('/pozos')
+@respuesta_personal('pozos', 'temporadas', proximos_pozos=True)
 def pozos():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -262,22 +1833,23 @@ def pozos():
         Pozo.fecha >= datetime.utcnow()
     ).order_by(Pozo.fecha).all()
 
-    # Historial de pozos jugados del usuario
-    historial_raw = db.session.query(Resultado, PozoJugado)\
-        .join(PozoJugado, Resultado.pozo_jugado_id == PozoJugado.id)\
-        .filter(Resultado.email == usuario.email)\
+    # Historial de pozos jugados del usuario (temporadas archivadas solo con ?archivo=1)
+    archivo = request.args.get('archivo') == '1'
+    R, Nivel = con_archivo(Resultado, archivo), con_archivo(HistorialNivel, archivo)
+    historial_raw = db.session.query(R, PozoJugado)\
+        .join(PozoJugado, R.pozo_jugado_id == PozoJugado.id)\
+        .filter(R.email == usuario.email)\
         .order_by(PozoJugado.fecha.desc()).all()
+    niveles_por_pozo = {h.pozo_jugado_id: h for h in db.session.query(Nivel).filter(
+        Nivel.usuario_id == usuario.id, Nivel.pozo_jugado_id.isnot(None))}
 
     # Construir lista con puntos acumulados y variación de nivel
     pozos_jugados = []
     puntos_acum = usuario.puntos_ranking  # empezamos desde el total actual y restamos hacia atrás
     for resultado, pozo in historial_raw:
         puntos_acum_display = puntos_acum
-        # Buscar variación de nivel en historial_nivel para este pozo
-        hist_nivel = HistorialNivel.query.filter_by(
-            usuario_id=usuario.id,
-            pozo_jugado_id=pozo.id
-        ).first()
+        # Variación de nivel en historial_nivel para este pozo
+        hist_nivel = niveles_por_pozo.get(pozo.id)
 
         variacion = round(hist_nivel.nivel_nuevo - hist_nivel.nivel_anterior, 2) if hist_nivel else 0
         nivel_nuevo = hist_nivel.nivel_nuevo if hist_nivel else usuario.nivel_playtomic
@@ -293,22 +1865,26 @@ def pozos():
         })
         puntos_acum -= resultado.puntos  # restamos para reconstruir hacia atrás
 
-    return render_template('pozos.html', pozos=pozos, mi_nivel=mi_nivel, pozos_jugados=pozos_jugados)
+    return render_template('pozos.html', pozos=pozos, mi_nivel=mi_nivel, pozos_jugados=pozos_jugados,
+                           archivo=archivo, hay_archivo=hay_temporadas_archivadas())
 
 
 @app.route('/estadisticas')
+@respuesta_personal('ranking', 'temporadas')
 def estadisticas():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
     usuario = Usuario.query.get(session['user_id'])
+    archivo = request.args.get('archivo') == '1'
 
-    resultados = Resultado.query.filter_by(email=usuario.email).all()
-    total_pozos = len(resultados)
-    primeros = sum(1 for r in resultados if r.posicion == 1)
-    segundos = sum(1 for r in resultados if r.posicion == 2)
-    terceros = sum(1 for r in resultados if r.posicion == 3)
-    participaciones = sum(1 for r in resultados if r.posicion is None)
+    # Totales de siempre (no dependen del archivo: las temporadas archivadas tienen su resumen)
+    totales = estadisticas_usuario(usuario.email)
+    total_pozos = totales['total_pozos']
+    primeros = totales['primeros']
+    segundos = totales['segundos']
+    terceros = totales['terceros']
+    participaciones = totales['participaciones']
 
     stats = {
         'total_pozos': total_pozos,
@@ -325,23 +1901,30 @@ def estadisticas():
     }
 
     # Media total de puntos por pozo
-    puntos_todos = [r.puntos for r in resultados]
-    media_total_puntos = round(sum(puntos_todos) / len(puntos_todos), 1) if puntos_todos else 0
+    media_total_puntos = round(totales['puntos'] / total_pozos, 1) if total_pozos else 0
 
     # Historial de nivel (orden cronológico)
-    historial = HistorialNivel.query.filter_by(usuario_id=usuario.id)\
-        .order_by(HistorialNivel.fecha.asc()).limit(20).all()
+    Nivel = con_archivo(HistorialNivel, archivo)
+    historial = db.session.query(Nivel).filter(Nivel.usuario_id == usuario.id)\
+        .order_by(Nivel.fecha.asc()).limit(20).all()
 
     # Últimos 10 pozos con resultado
-    ultimos_pozos = db.session.query(Resultado, PozoJugado)\
-        .join(PozoJugado, Resultado.pozo_jugado_id == PozoJugado.id)\
-        .filter(Resultado.email == usuario.email)\
+    R = con_archivo(Resultado, archivo)
+    ultimos_pozos = db.session.query(R, PozoJugado)\
+        .join(PozoJugado, R.pozo_jugado_id == PozoJugado.id)\
+        .filter(R.email == usuario.email)\
         .order_by(PozoJugado.fecha.asc())\
         .limit(10).all()
 
-    # Historial de posición en ranking
-    historial_ranking = HistorialRanking.query.filter_by(usuario_id=usuario.id)\
-        .order_by(HistorialRanking.fecha.asc()).limit(20).all()
+    # Historial de posición en ranking (todos los pozos del club, no solo los jugados)
+    historial_ranking = historial_ranking_usuario(usuario, archivo=archivo)
+
+    # Compañeros y cara a cara
+    frecuentes = companeros_frecuentes(usuario.email)
+    mejores = mejores_companeros(usuario.email)
+    rival_email = request.args.get('rival', '').strip().lower()
+    rival = Usuario.query.filter(db.func.lower(Usuario.email) == rival_email).first() if rival_email else None
+    balance_rival = cara_a_cara(usuario.email, rival.email, archivo=archivo) if rival else None
 
     return render_template('estadisticas.html',
                            stats=stats,
@@ -349,7 +1932,14 @@ def estadisticas():
                            historial=historial,
                            ultimos_pozos=ultimos_pozos,
                            historial_ranking=historial_ranking,
-                           media_total_puntos=media_total_puntos)
+                           media_total_puntos=media_total_puntos,
+                           companeros_frecuentes=frecuentes,
+                           mejores_companeros=mejores,
+                           rival_email=rival_email,
+                           rival=rival,
+                           balance_rival=balance_rival,
+                           archivo=archivo,
+                           hay_archivo=hay_temporadas_archivadas())
 
 
 @app.route('/ranking')
@@ -363,7 +1953,9 @@ def ranking():
 
 @app.route('/logout')
 def logout():
+    club_id = session.get('club_id')
     session.clear()
+    session['club_id'] = club_id
     flash('Has cerrado sesión correctamente', 'success')
     return redirect(url_for('login'))
 
@@ -378,6 +1970,8 @@ def admin_panel():
 
     usuarios = Usuario.query.order_by(Usuario.fecha_registro.desc()).all()
     pozos = Pozo.query.filter_by(activo=True).order_by(Pozo.fecha).all()
+    envios = {e.pozo_id: e for e in EnvioNotificacion.query.filter(
+        EnvioNotificacion.pozo_id.in_([p.id for p in pozos])).all()}
     pozos_jugados = PozoJugado.query.order_by(PozoJugado.fecha.desc()).all()
 
     # Filtros
@@ -387,27 +1981,13 @@ def admin_panel():
     filtro_nivel_min = request.args.get('nivel_min', '')
     filtro_nivel_max = request.args.get('nivel_max', '')
 
-    query = Usuario.query
-    if filtro_semana:
-        query = query.filter(
-            (Usuario.disponibilidad_semana == filtro_semana) |
-            (Usuario.disponibilidad_semana == 'ambos')
-        )
-    if filtro_horario:
-        query = query.filter(Usuario.disponibilidad_horaria.contains(filtro_horario))
-    if filtro_ultima_hora:
-        query = query.filter(Usuario.disponible_sustituciones == True)
-    if filtro_nivel_min:
-        query = query.filter(Usuario.nivel_playtomic >= float(filtro_nivel_min))
-    if filtro_nivel_max:
-        query = query.filter(Usuario.nivel_playtomic <= float(filtro_nivel_max))
-
     hay_filtro = any([filtro_semana, filtro_horario, filtro_ultima_hora, filtro_nivel_min, filtro_nivel_max])
-    usuarios_filtrados = query.order_by(Usuario.nombre).all() if hay_filtro else []
+    usuarios_filtrados = filtrar_usuarios(Usuario.query, request.args).order_by(Usuario.nombre).all() if hay_filtro else []
 
     return render_template('admin_new.html',
                            usuarios=usuarios,
                            pozos=pozos,
+                           envios=envios,
                            pozos_jugados=pozos_jugados,
                            usuarios_filtrados=usuarios_filtrados,
                            filtro_semana=filtro_semana,
@@ -417,6 +1997,110 @@ def admin_panel():
                            filtro_nivel_max=filtro_nivel_max)
 
 
+@app.route('/admin/buscar_usuarios')
+def buscar_usuarios_admin():
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'No tienes permisos de administrador'}), 403
+
+    return jsonify([{
+        'id': u.id,
+        'nombre': u.nombre,
+        'email': u.email,
+        'nivel': u.nivel_playtomic,
+        'puntos': u.puntos_ranking
+    } for u in buscar_usuarios(request.args.get('q', ''))])
+
+
+# ── EXPORTACIONES CSV ────────────────────────────────────────────────────────
+
+LOTE_EXPORTACION = 500
+
+
+@app.route('/admin/exportar/ranking.csv')
+def exportar_ranking():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    filas = db.session.query(Usuario.nombre, Usuario.email, Usuario.nivel_playtomic, Usuario.puntos_ranking)\
+        .order_by(Usuario.puntos_ranking.desc(), Usuario.id)\
+        .yield_per(LOTE_EXPORTACION)
+
+    return respuesta_csv(
+        'ranking.csv',
+        ['posicion', 'nombre', 'email', 'nivel', 'puntos'],
+        ((i, nombre, email, nivel, puntos) for i, (nombre, email, nivel, puntos) in enumerate(filas, start=1))
+    )
+
+
+@app.route('/admin/exportar/resultados/<int:pozo_id>.csv')
+def exportar_resultados(pozo_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    pozo = PozoJugado.query.get_or_404(pozo_id)
+    R = con_archivo(Resultado, fecha_archivada(pozo.fecha))
+    filas = db.session.query(R.email, Usuario.nombre, R.posicion, R.puntos)\
+        .outerjoin(Usuario, Usuario.email == R.email)\
+        .filter(R.pozo_jugado_id == pozo_id)\
+        .order_by(R.posicion, R.id)\
+        .yield_per(LOTE_EXPORTACION)
+
+    return respuesta_csv(
+        f'resultados_pozo_{pozo.id}.csv',
+        ['email', 'nombre', 'posicion', 'puntos'],
+        filas
+    )
+
+
+@app.route('/admin/exportar/historial/<int:user_id>.csv')
+def exportar_historial_usuario(user_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    usuario = Usuario.query.get_or_404(user_id)
+    archivo = request.args.get('archivo') == '1'
+    R, Nivel = con_archivo(Resultado, archivo), con_archivo(HistorialNivel, archivo)
+    filas = db.session.query(
+        PozoJugado.fecha, PozoJugado.titulo, R.posicion, R.puntos,
+        Nivel.nivel_anterior, Nivel.nivel_nuevo
+    ).join(PozoJugado, R.pozo_jugado_id == PozoJugado.id)\
+        .outerjoin(Nivel, (Nivel.pozo_jugado_id == PozoJugado.id) &
+                   (Nivel.usuario_id == usuario.id))\
+        .filter(R.email == usuario.email)\
+        .order_by(PozoJugado.fecha)\
+        .yield_per(LOTE_EXPORTACION)
+
+    return respuesta_csv(
+        f'historial_{usuario.id}.csv',
+        ['fecha', 'pozo', 'posicion', 'puntos', 'nivel_anterior', 'nivel_nuevo'],
+        ((fecha.strftime('%Y-%m-%d') if fecha else '', titulo, posicion, puntos, anterior, nuevo)
+         for fecha, titulo, posicion, puntos, anterior, nuevo in filas)
+    )
+
+
+@app.route('/admin/exportar/usuarios.csv')
+def exportar_usuarios():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    query = db.session.query(
+        Usuario.nombre, Usuario.email, Usuario.telefono, Usuario.nivel_playtomic,
+        Usuario.disponibilidad_semana, Usuario.disponibilidad_horaria, Usuario.disponible_sustituciones
+    )
+    filas = filtrar_usuarios(query, request.args).order_by(Usuario.nombre).yield_per(LOTE_EXPORTACION)
+
+    return respuesta_csv(
+        'usuarios.csv',
+        ['nombre', 'email', 'telefono', 'nivel', 'disponibilidad_semana', 'disponibilidad_horaria', 'ultima_hora'],
+        ((nombre, email, telefono or '', nivel, semana or '', horaria or '', 'si' if ultima_hora else 'no')
+         for nombre, email, telefono, nivel, semana, horaria, ultima_hora in filas)
+    )
+
+
 @app.route('/admin/toggle_user/<int:user_id>')
 
 def toggle_user(user_id):
@@ -441,6 +2125,8 @@ def actualizar_nivel(user_id):
     if usuario:
         nuevo_nivel = request.form.get('nivel', 0)
         usuario.nivel_playtomic = float(nuevo_nivel)
+        incrementar_version_personal(usuario)
+        incrementar_version('ranking')
         db.session.commit()
         flash(f'Nivel de {usuario.nombre} actualizado a {nuevo_nivel}', 'success')
 
@@ -474,8 +2160,11 @@ def crear_pozo():
         )
 
         db.session.add(nuevo_pozo)
+        incrementar_version('pozos')
         db.session.commit()
 
+        lanzar_notificaciones_pozo(nuevo_pozo)
+
         flash(f'Pozo "{titulo}" creado correctamente', 'success')
         return redirect(url_for('admin_panel'))
 
@@ -500,6 +2189,7 @@ def editar_pozo(pozo_id):
         if fecha_str:
             pozo.fecha = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M')
 
+        incrementar_version('pozos')
         db.session.commit()
         flash(f'Pozo "{pozo.titulo}" actualizado', 'success')
         return redirect(url_for('admin_panel'))
@@ -515,13 +2205,51 @@ def borrar_pozo(pozo_id):
 
     pozo = Pozo.query.get_or_404(pozo_id)
     titulo = pozo.titulo
+    EnvioNotificacion.query.filter_by(pozo_id=pozo_id).delete()
     db.session.delete(pozo)
+    incrementar_version('pozos')
     db.session.commit()
 
     flash(f'Pozo "{titulo}" eliminado', 'success')
     return redirect(url_for('admin_panel'))
 
 
+@app.route('/admin/sorteo/<int:pozo_id>', methods=['GET', 'POST'])
+def sorteo_pozo(pozo_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    pozo = Pozo.query.get_or_404(pozo_id)
+    emails_texto = request.form.get('emails', '')
+    resultado_sorteo = None
+    no_encontrados = []
+
+    if request.method == 'POST':
+        emails = []
+        for email in emails_texto.replace(',', '\n').split('\n'):
+            email = email.strip().lower()
+            if email and email not in emails:
+                emails.append(email)
+
+        usuarios = {u.email.lower(): u for u in Usuario.query.filter(db.func.lower(Usuario.email).in_(emails)).all()}
+        no_encontrados = [e for e in emails if e not in usuarios]
+        jugadores = [{
+            'id': usuarios[e].id,
+            'nombre': usuarios[e].nombre,
+            'nivel': usuarios[e].nivel_playtomic or 0,
+            'posicion': usuarios[e].posicion_juego
+        } for e in emails if e in usuarios]
+
+        if len(jugadores) < 4:
+            flash('Hacen falta al menos 4 jugadores registrados para el sorteo', 'error')
+        else:
+            resultado_sorteo = generar_sorteo(jugadores)
+
+    return render_template('sorteo.html', pozo=pozo, sorteo=resultado_sorteo,
+                           emails_texto=emails_texto, no_encontrados=no_encontrados)
+
+
 @app.route('/admin/subir_resultados', methods=['GET', 'POST'])
 def subir_resultados():
     if 'user_id' not in session or not session.get('is_admin'):
@@ -567,82 +2295,80 @@ def subir_resultados():
         media_pozo = sum(niveles_totales) / len(niveles_totales) if niveles_totales else 0
 
         fecha = datetime.strptime(fecha_pozo, '%Y-%m-%d') if fecha_pozo else datetime.utcnow()
+        if fecha_archivada(fecha):
+            flash('Esa fecha pertenece a una temporada archivada', 'error')
+            return redirect(url_for('subir_resultados'))
+
+        # Todo en una transacción que empieza bloqueando el ranking del club: otra subida
+        # simultánea espera, y las lecturas (jugadores, compañeros, clasificación e
+        # indice_club) no se quedan viejas. Primero las lecturas y después las escrituras,
+        # sin SELECT de por medio; la analítica, que sí necesita consultas, va después del commit
+        bloquear_ranking()
+        emails = {p['email1'] for p in parejas} | {p['email2'] for p in parejas}
+        usuarios = {u.email: u for u in Usuario.query.filter(Usuario.email.in_(emails))}
+        companeros = {(f.email, f.email_companero): f for f in
+                      EstadisticaCompanero.query.filter(EstadisticaCompanero.email.in_(emails))}
+        # Clasificación completa para el snapshot; los puntos de los jugadores del pozo se ponen al final
+        clasificacion = {usuario_id: (puntos, indice) for usuario_id, puntos, indice in
+                         db.session.query(Usuario.id, Usuario.puntos_ranking, Usuario.indice_club)}
+
         pozo_jugado = PozoJugado(
             titulo=titulo_pozo,
             fecha=fecha,
             nivel=media_pozo
         )
         db.session.add(pozo_jugado)
-        db.session.commit()
-
-        for pareja in parejas:
-            diferencia = pareja['media_pareja'] - media_pozo
-            posicion = pareja['posicion']
-
-            if diferencia < -0.3:
-                variaciones = {1: 0.10, 2: 0.08, 3: 0.06, None: 0}
-            elif diferencia > 0.3:
-                variaciones = {1: 0.04, 2: 0.02, 3: 0.01, None: -0.02}
-            else:
-                variaciones = {1: 0.06, 2: 0.04, 3: 0.02, None: -0.01}
-
-            variacion = variaciones.get(posicion, 0)
-            puntos = {1: 10, 2: 6, 3: 4, None: 2}.get(posicion, 2)
-
-            for email, nivel in [(pareja['email1'], pareja['nivel1']), (pareja['email2'], pareja['nivel2'])]:
-                resultado = Resultado(
-                    pozo_jugado_id=pozo_jugado.id,
-                    email=email,
-                    posicion=posicion,
-                    puntos=puntos
-                )
-                db.session.add(resultado)
-
-                usuario = Usuario.query.filter_by(email=email).first()
-                if usuario:
-                    nivel_anterior = usuario.nivel_playtomic
-                    usuario.puntos_ranking += puntos
-                    usuario.nivel_playtomic = round(usuario.nivel_playtomic + variacion, 2)
-                    usuario.nivel_playtomic = max(0, min(7, usuario.nivel_playtomic))
-
-                    # Guardar historial de nivel si hubo cambio
-                    if variacion != 0:
-                        historial_nivel = HistorialNivel(
-                            usuario_id=usuario.id,
-                            nivel_anterior=nivel_anterior,
-                            nivel_nuevo=usuario.nivel_playtomic,
-                            pozo_jugado_id=pozo_jugado.id
-                        )
-                        db.session.add(historial_nivel)
-
-        # Guardar historial de ranking para todos los participantes
-        # (lo hacemos después de actualizar todos los puntos)
-        db.session.commit()
-
-        todos_usuarios = Usuario.query.order_by(Usuario.puntos_ranking.desc()).all()
-        emails_participantes = set()
-        for pareja in parejas:
-            emails_participantes.add(pareja['email1'])
-            emails_participantes.add(pareja['email2'])
-
-        for email in emails_participantes:
-            usuario = Usuario.query.filter_by(email=email).first()
-            if usuario:
-                posicion_ranking = next(
-                    (i + 1 for i, u in enumerate(todos_usuarios) if u.id == usuario.id),
-                    None
-                )
-                if posicion_ranking:
-                    historial_rank = HistorialRanking(
-                        usuario_id=usuario.id,
-                        posicion=posicion_ranking,
-                        puntos=usuario.puntos_ranking,
-                        pozo_jugado_id=pozo_jugado.id
+        db.session.flush()
+
+        with db.session.no_autoflush:
+            for numero, pareja in enumerate(parejas, start=1):
+                posicion = pareja['posicion']
+                variacion, puntos = variacion_y_puntos(pareja['media_pareja'], media_pozo, posicion)
+                acumular_pareja(pareja['email1'], pareja['email2'], posicion, puntos, filas=companeros)
+
+                for email, nivel in [(pareja['email1'], pareja['nivel1']), (pareja['email2'], pareja['nivel2'])]:
+                    resultado = Resultado(
+                        pozo_jugado_id=pozo_jugado.id,
+                        email=email,
+                        posicion=posicion,
+                        puntos=puntos,
+                        pareja=numero
                     )
-                    db.session.add(historial_rank)
+                    db.session.add(resultado)
+
+                    usuario = usuarios.get(email)
+                    if usuario:
+                        nivel_anterior = usuario.nivel_playtomic
+                        usuario.puntos_ranking += puntos
+                        usuario.nivel_playtomic = aplicar_variacion(usuario.nivel_playtomic, variacion)
+
+                        # Guardar historial de nivel si hubo cambio
+                        if variacion != 0:
+                            historial_nivel = HistorialNivel(
+                                usuario_id=usuario.id,
+                                nivel_anterior=nivel_anterior,
+                                nivel_nuevo=usuario.nivel_playtomic,
+                                pozo_jugado_id=pozo_jugado.id
+                            )
+                            db.session.add(historial_nivel)
+
+        # Snapshot del ranking completo, con los puntos ya sumados
+        for usuario in usuarios.values():
+            clasificacion[usuario.id] = (usuario.puntos_ranking, clasificacion[usuario.id][1])
+        guardar_snapshot_ranking(pozo_jugado, [(i, p, indice) for i, (p, indice) in clasificacion.items()])
+        incrementar_version_personal(*usuarios.values())
 
         db.session.commit()
 
+        try:
+            actualizar_analitica(pozo_jugado)
+            db.session.commit()
+        except Exception:
+            # Otra subida la ha actualizado a la vez: se recalculará entera al consultarla
+            db.session.rollback()
+            invalidar_analitica()
+            db.session.commit()
+
         flash(f'Resultados del pozo "{titulo_pozo}" guardados. Media del pozo: {media_pozo:.2f}', 'success')
         return redirect(url_for('admin_panel'))
 
@@ -656,9 +2382,12 @@ def ver_resultados(pozo_id):
         return redirect(url_for('login'))
 
     pozo = PozoJugado.query.get_or_404(pozo_id)
-    resultados = Resultado.query.filter_by(pozo_jugado_id=pozo_id).order_by(Resultado.posicion).all()
+    R = con_archivo(Resultado, fecha_archivada(pozo.fecha))
+    resultados = db.session.query(R).filter(R.pozo_jugado_id == pozo_id).order_by(R.posicion).all()
+    subidas, bajadas = movimientos_ranking(pozo_id, archivo=fecha_archivada(pozo.fecha))
 
-    return render_template('ver_resultados.html', pozo=pozo, resultados=resultados)
+    return render_template('ver_resultados.html', pozo=pozo, resultados=resultados,
+                           subidas=subidas, bajadas=bajadas)
 
 @app.route('/admin/editar_pozo_jugado/<int:pozo_id>', methods=['GET', 'POST'])
 def editar_pozo_jugado(pozo_id):
@@ -667,15 +2396,28 @@ def editar_pozo_jugado(pozo_id):
         return redirect(url_for('login'))
 
     pozo = PozoJugado.query.get_or_404(pozo_id)
-    resultados = Resultado.query.filter_by(pozo_jugado_id=pozo_id).all()
+    R = con_archivo(Resultado, fecha_archivada(pozo.fecha))
+    resultados = db.session.query(R).filter(R.pozo_jugado_id == pozo_id).all()
 
     if request.method == 'POST':
-        pozo.titulo = request.form.get('titulo')
         fecha_str = request.form.get('fecha')
         if fecha_str:
-            pozo.fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+            fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+            # Sus resultados están en una tabla u otra según la temporada: no se cruza la frontera
+            if fecha != pozo.fecha and (fecha_archivada(pozo.fecha) or fecha_archivada(fecha)):
+                flash('No se puede mover un pozo a o desde una temporada archivada', 'error')
+                return redirect(url_for('editar_pozo_jugado', pozo_id=pozo_id))
+            pozo.fecha = fecha
+            # El historial de ranking ordena los snapshots por su propia fecha
+            Snapshot = SnapshotRankingArchivo if fecha_archivada(fecha) else SnapshotRanking
+            db.session.query(Snapshot).filter(Snapshot.pozo_jugado_id == pozo_id)\
+                .update({Snapshot.fecha: fecha}, synchronize_session=False)
+        pozo.titulo = request.form.get('titulo')
         nivel_str = request.form.get('nivel')
         pozo.nivel = float(nivel_str) if nivel_str else pozo.nivel
+        # Título y fecha salen en el historial de cada jugador del pozo
+        incrementar_version_personal(*Usuario.query.filter(Usuario.email.in_({r.email for r in resultados})))
+        invalidar_analitica()
         db.session.commit()
         flash(f'Pozo "{pozo.titulo}" actualizado correctamente', 'success')
         return redirect(url_for('admin_panel'))
@@ -690,11 +2432,26 @@ def borrar_pozo_jugado(pozo_id):
         return redirect(url_for('login'))
 
     pozo = PozoJugado.query.get_or_404(pozo_id)
-    resultados = Resultado.query.filter_by(pozo_jugado_id=pozo_id).all()
+    if fecha_archivada(pozo.fecha):
+        flash('El pozo pertenece a una temporada archivada y no se puede borrar', 'error')
+        return redirect(url_for('admin_panel'))
+
+    bloquear_ranking()
+    resultados = Resultado.query.filter_by(pozo_jugado_id=pozo_id).order_by(Resultado.pareja, Resultado.id).all()
+
+    # Descontar las parejas del agregado de compañeros
+    por_pareja = {}
+    for resultado in resultados:
+        if resultado.pareja is not None:
+            por_pareja.setdefault(resultado.pareja, []).append(resultado)
+    for pareja in por_pareja.values():
+        if len(pareja) == 2:
+            acumular_pareja(pareja[0].email, pareja[1].email, pareja[0].posicion, pareja[0].puntos, signo=-1)
 
     for resultado in resultados:
         usuario = Usuario.query.filter_by(email=resultado.email).first()
         if usuario:
+            incrementar_version_personal(usuario)
             usuario.puntos_ranking = max(0, usuario.puntos_ranking - resultado.puntos)
             hist_nivel = HistorialNivel.query.filter_by(
                 usuario_id=usuario.id,
@@ -711,13 +2468,83 @@ def borrar_pozo_jugado(pozo_id):
                 db.session.delete(hist_rank)
         db.session.delete(resultado)
 
+    SnapshotRanking.query.filter_by(pozo_jugado_id=pozo_id).delete()
+
     titulo = pozo.titulo
     db.session.delete(pozo)
+    invalidar_analitica()
     db.session.commit()
 
     flash(f'Pozo "{titulo}" eliminado y puntos/nivel revertidos correctamente', 'success')
     return redirect(url_for('admin_panel'))
 
+@app.route('/admin/analitica')
+def analitica():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    datos, actualizada = analitica_club()
+    if request.args.get('formato') == 'json':
+        return jsonify(datos)
+    return render_template('analitica.html', datos=datos, actualizada=actualizada)
+
+
+@app.route('/admin/temporadas', methods=['GET', 'POST'])
+def temporadas():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        nombre = request.form.get('nombre', '').strip()
+        try:
+            inicio = datetime.strptime(request.form.get('inicio', ''), '%Y-%m-%d')
+        except ValueError:
+            inicio = None
+        if not nombre or inicio is None:
+            flash('Indica el nombre y la fecha de inicio de la temporada', 'error')
+            return redirect(url_for('temporadas'))
+        en_curso = Temporada.query.filter(Temporada.fin.is_(None)).first()
+
+        if en_curso and inicio <= en_curso.inicio:
+            flash(f'La nueva temporada debe empezar después del {en_curso.inicio.strftime("%d/%m/%Y")}', 'error')
+            return redirect(url_for('temporadas'))
+
+        if en_curso:
+            en_curso.fin = inicio
+        db.session.add(Temporada(nombre=nombre, inicio=inicio))
+        db.session.commit()
+        flash(f'Temporada "{nombre}" creada', 'success')
+        return redirect(url_for('temporadas'))
+
+    lista = Temporada.query.order_by(Temporada.inicio.desc()).all()
+    pozos_por_temporada = {}
+    for temporada in lista:
+        consulta = PozoJugado.query.filter(PozoJugado.fecha >= temporada.inicio)
+        if temporada.fin:
+            consulta = consulta.filter(PozoJugado.fecha < temporada.fin)
+        pozos_por_temporada[temporada.id] = consulta.count()
+
+    return render_template('temporadas.html', temporadas=lista, pozos_por_temporada=pozos_por_temporada)
+
+
+@app.route('/admin/temporadas/<int:temporada_id>/archivar')
+def archivar_temporada_admin(temporada_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('No tienes permisos de administrador', 'error')
+        return redirect(url_for('login'))
+
+    temporada = Temporada.query.get_or_404(temporada_id)
+    if temporada.archivada or temporada.fin is None:
+        flash('Solo se pueden archivar temporadas cerradas', 'error')
+        return redirect(url_for('temporadas'))
+
+    movidas = archivar_temporada(temporada)
+    flash(f'Temporada "{temporada.nombre}" archivada: {movidas["resultados"]} resultados movidos al archivo', 'success')
+    return redirect(url_for('temporadas'))
+
+
 @app.context_processor
 def inject_usuario_actual():
     if 'user_id' in session:
@@ -746,7 +2573,7 @@ def perfil():
         foto = request.files.get('foto')
         if foto and foto.filename:
             try:
-                resultado = cloudinary.uploader.upload(
+                resultado = cloudinary_uploader().upload(
                     foto,
                     folder='lapecera/perfiles',
                     transformation=[{'width': 400, 'height': 400, 'crop': 'fill', 'gravity': 'face'}]
@@ -756,6 +2583,8 @@ def perfil():
                 flash(f'Error al subir la foto: {str(e)}', 'error')
 
         session['user_name'] = usuario.nombre
+        incrementar_version_personal(usuario)
+        incrementar_version('ranking', 'usuarios')
         db.session.commit()
         flash('Perfil actualizado correctamente', 'success')
         return redirect(url_for('perfil'))
@@ -794,20 +2623,25 @@ def cambiar_password():
 def recuperar_password():
     if request.method == 'POST':
         email = request.form.get('email')
-        usuario = Usuario.query.filter_by(email=email).first()
+        usuario = Usuario.query.filter_by(email=email).execution_options(todos_los_clubes=True).first()
         if usuario:
             token = secrets.token_urlsafe(32)
             usuario.reset_token = token
+            usuario.reset_token_fecha = datetime.utcnow()
             db.session.commit()
             app_url = os.environ.get('APP_URL', 'http://localhost:5001')
             enlace = f"{app_url}/reset_password/{token}"
+            club = _buscar_club('id', usuario.club_id)
+            nombre_club = club[1] if club else 'La Pecera'
+            from sendgrid.helpers.mail import Mail
+
             mensaje = Mail(
                 from_email=os.environ.get('SENDGRID_FROM_EMAIL'),
                 to_emails=email,
-                subject='Recuperar contraseña - La Pecera Padel Hub',
+                subject=f'Recuperar contraseña - {nombre_club} Padel Hub',
                 html_content=f'''
                 <div style="font-family: Arial, sans-serif; max-width: 500px; margin: auto;">
-                    <h2 style="color: #10b981;">🎾 La Pecera Padel Hub</h2>
+                    <h2 style="color: #10b981;">🎾 {nombre_club} Padel Hub</h2>
                     <p>Hola <strong>{usuario.nombre}</strong>,</p>
                     <p>Recibimos una solicitud para restablecer tu contraseña.</p>
                     <p>
@@ -823,8 +2657,7 @@ def recuperar_password():
                 '''
             )
             try:
-                sg = SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
-                sg.send(mensaje)
+                sendgrid_cliente().send(mensaje)
             except Exception as e:
                 print(f"Error SendGrid: {e}")
         flash('Si el email existe, recibirás un enlace en breve', 'success')
@@ -834,8 +2667,10 @@ def recuperar_password():
 
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    usuario = Usuario.query.filter_by(reset_token=token).first()
-    if not usuario:
+    usuario = Usuario.query.filter_by(reset_token=token).execution_options(todos_los_clubes=True).first()
+    caducado = usuario and (usuario.reset_token_fecha is None or
+                            usuario.reset_token_fecha < datetime.utcnow() - CADUCIDAD_RESET_TOKEN)
+    if not usuario or caducado:
         flash('Enlace inválido o expirado', 'error')
         return redirect(url_for('login'))
     if request.method == 'POST':
@@ -849,6 +2684,7 @@ def reset_password(token):
             return redirect(url_for('reset_password', token=token))
         usuario.set_password(password_nueva)
         usuario.reset_token = None
+        usuario.reset_token_fecha = None
         db.session.commit()
         flash('Contraseña cambiada correctamente, ya puedes iniciar sesión', 'success')
         return redirect(url_for('login'))
@@ -857,10 +2693,56 @@ def reset_password(token):
 
 # ── INICIALIZACIÓN Y MIGRACIONES ─────────────────────────────────────────────
 
+TIEMPOS_ARRANQUE['app'] = time.perf_counter() - _inicio_arranque - TIEMPOS_ARRANQUE['imports']
+_inicio_migraciones = time.perf_counter()
+
 with app.app_context():
     db.create_all()
 
     from sqlalchemy import text, inspect
+
+    # Clubes: va primero porque el resto de migraciones ya consultan con club_id
+    try:
+        if db.session.get(Club, CLUB_POR_DEFECTO) is None:
+            db.session.add(Club(id=CLUB_POR_DEFECTO, nombre=os.environ.get('CLUB_NOMBRE', 'La Pecera'), slug='la-pecera'))
+            db.session.commit()
+            if db.engine.dialect.name == 'postgresql':
+                # El id se ha puesto a mano: la secuencia tiene que saltárselo
+                db.session.execute(text("SELECT setval(pg_get_serial_sequence('clubes', 'id'), "
+                                        "(SELECT MAX(id) FROM clubes))"))
+                db.session.commit()
+            print("✅ Club por defecto creado")
+
+        inspector = inspect(db.engine)
+        tablas = inspector.get_table_names()
+        # Las tablas de antes de los clubes pasan enteras al club por defecto
+        referencia = ' REFERENCES clubes (id)' if db.engine.dialect.name == 'postgresql' else ''
+        for modelo in ConClub.__subclasses__():
+            tabla = modelo.__table__
+            if tabla.name not in tablas:
+                continue
+            if 'club_id' not in [col['name'] for col in inspector.get_columns(tabla.name)]:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN club_id INTEGER NOT NULL '
+                                      f'DEFAULT {CLUB_POR_DEFECTO}{referencia}'))
+                    conn.commit()
+                print(f"✅ Añadida columna: {tabla.name}.club_id")
+            existentes = {col['name'] for col in inspector.get_columns(tabla.name)} | {'club_id'}
+            for indice in tabla.indexes:
+                # Los índices de columnas que se añaden más abajo se crean con ellas
+                if {col.name for col in indice.columns} <= existentes:
+                    indice.create(db.engine, checkfirst=True)
+
+        with db.engine.connect() as conn:
+            if 'versiones_datos' in tablas:
+                conn.execute(text(f"UPDATE versiones_datos SET clave = '{CLUB_POR_DEFECTO}:' || clave "
+                                  "WHERE clave NOT LIKE '%:%'"))
+                conn.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Migración Clubes: {e}")
+
     try:
         inspector = inspect(db.engine)
         columns = [col['name'] for col in inspector.get_columns('usuario')]
@@ -912,16 +2794,110 @@ with app.app_context():
             if 'reset_token' not in columns:
                 conn.execute(text('ALTER TABLE usuario ADD COLUMN reset_token VARCHAR(100)'))
                 conn.commit()
+
+            if 'reset_token_fecha' not in columns:
+                conn.execute(text('ALTER TABLE usuario ADD COLUMN reset_token_fecha TIMESTAMP'))
+                conn.commit()
+
+            if 'busqueda' not in columns:
+                conn.execute(text('ALTER TABLE usuario ADD COLUMN busqueda VARCHAR(250)'))
+                conn.commit()
+                print("✅ Añadida columna: busqueda")
+
+            if 'version_personal' not in columns:
+                conn.execute(text('ALTER TABLE usuario ADD COLUMN version_personal INTEGER NOT NULL DEFAULT 0'))
+                conn.commit()
+                print("✅ Añadida columna: version_personal")
             
             if 'disponible_sustituciones' not in columns:
                 conn.execute(text('ALTER TABLE usuario ADD COLUMN disponible_sustituciones BOOLEAN DEFAULT FALSE'))
                 conn.commit()
 
+            if 'indice_club' not in columns:
+                conn.execute(text('ALTER TABLE usuario ADD COLUMN indice_club INTEGER'))
+                conn.commit()
+                print("✅ Añadida columna: indice_club")
+
+        if 'indice_club' not in columns:
+            # Numerar a los jugadores de cada club y rehacer el índice inverso de los snapshots,
+            # que hasta ahora iba por Usuario.id
+            indices = {}
+            for club_id, usuario_id in db.session.query(Usuario.club_id, Usuario.id).order_by(Usuario.id):
+                por_club = indices.setdefault(club_id, {})
+                por_club[usuario_id] = len(por_club)
+            for por_club in indices.values():
+                db.session.execute(db.update(Usuario), [{'id': i, 'indice_club': n} for i, n in por_club.items()])
+            snapshots = SnapshotRanking.query.options(db.undefer(SnapshotRanking.ids)).all()
+            for snapshot in snapshots:
+                snapshot.posiciones = _indice_inverso(_desempaquetar(snapshot.ids), indices.get(snapshot.club_id, {}))
+            db.session.commit()
+            print(f"✅ Índice de ranking rehecho para {len(snapshots)} snapshots")
+        for indice in Usuario.__table__.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+        # Rellenar el texto de búsqueda de los usuarios anteriores a la columna
+        pendientes = Usuario.query.filter(Usuario.busqueda.is_(None)).all()
+        for usuario in pendientes:
+            usuario.busqueda = normalizar(f'{usuario.nombre} {usuario.email}')
+        if pendientes:
+            db.session.commit()
+            print(f"✅ Texto de búsqueda calculado para {len(pendientes)} usuarios")
+
+        if db.engine.dialect.name == 'postgresql':
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_usuario_busqueda_trgm '
+                                      'ON usuario USING gin (busqueda gin_trgm_ops)'))
+                    conn.commit()
+                app.config['BUSQUEDA_TRIGRAMAS'] = True
+            except Exception as e:
+                # Sin pg_trgm el buscador sigue funcionando solo con LIKE
+                print(f"Índice de trigramas no disponible: {e}")
+
         print("✅ Migración de Usuario completada")
 
     except Exception as e:
         print(f"Migración Usuario: {e}")
 
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('resultados')]
+
+        with db.engine.connect() as conn:
+            if 'pareja' not in columns:
+                conn.execute(text('ALTER TABLE resultados ADD COLUMN pareja INTEGER'))
+                conn.commit()
+                print("✅ Añadida columna: resultados.pareja")
+
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_resultados_email ON resultados (email)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_resultados_pozo_jugado_id ON resultados (pozo_jugado_id)'))
+            conn.commit()
+
+        # Resultados antiguos sin pareja: subir_resultados guardaba los dos jugadores seguidos
+        sin_pareja = db.session.query(Resultado.id, Resultado.pozo_jugado_id)\
+            .filter(Resultado.pareja.is_(None))\
+            .order_by(Resultado.pozo_jugado_id, Resultado.id).all()
+        if sin_pareja:
+            pozo_actual, indice = None, 0
+            for resultado_id, pozo_id in sin_pareja:
+                if pozo_id != pozo_actual:
+                    pozo_actual, indice = pozo_id, 0
+                Resultado.query.filter_by(id=resultado_id).update({Resultado.pareja: indice // 2 + 1})
+                indice += 1
+            db.session.commit()
+            print(f"✅ Parejas reconstruidas en {len(sin_pareja)} resultados")
+
+        for club_id, in db.session.query(Club.id).all():
+            with en_club(club_id):
+                if db.session.query(Resultado.id).first() and not db.session.query(EstadisticaCompanero.email).first():
+                    reconstruir_companeros()
+                    print(f"✅ Agregado de compañeros calculado (club {club_id})")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Migración Resultado: {e}")
+
     try:
         inspector = inspect(db.engine)
         tablas = inspector.get_table_names()
@@ -956,9 +2932,116 @@ with app.app_context():
         else:
             print("✅ Tabla historial_ranking ya existe")
 
+        if 'snapshots_ranking' not in tablas:
+            SnapshotRanking.__table__.create(db.engine)
+            print("✅ Tabla snapshots_ranking creada")
+        else:
+            print("✅ Tabla snapshots_ranking ya existe")
+
+        if 'envios_notificacion' not in tablas:
+            EnvioNotificacion.__table__.create(db.engine)
+            print("✅ Tabla envios_notificacion creada")
+        else:
+            print("✅ Tabla envios_notificacion ya existe")
+            if 'ultimo_usuario_id' not in [col['name'] for col in inspector.get_columns('envios_notificacion')]:
+                with db.engine.connect() as conn:
+                    conn.execute(text('ALTER TABLE envios_notificacion ADD COLUMN ultimo_usuario_id INTEGER'))
+                    conn.commit()
+                print("✅ Añadida columna: envios_notificacion.ultimo_usuario_id")
+
+        if 'versiones_datos' not in tablas:
+            VersionDatos.__table__.create(db.engine)
+            print("✅ Tabla versiones_datos creada")
+        else:
+            print("✅ Tabla versiones_datos ya existe")
+
+        for modelo in (TareaProgramada, Temporada, ResumenTemporada, ResultadoArchivo, HistorialNivelArchivo,
+                       HistorialRankingArchivo, SnapshotRankingArchivo, AnaliticaClub):
+            if modelo.__tablename__ not in tablas:
+                modelo.__table__.create(db.engine)
+                print(f"✅ Tabla {modelo.__tablename__} creada")
+            else:
+                print(f"✅ Tabla {modelo.__tablename__} ya existe")
+
+        if db.engine.dialect.name == 'postgresql':
+            # posiciones ya va compacto: sin comprimir (EXTERNAL) el substr de historial_ranking_usuario
+            # lee solo los trozos TOAST de sus 4 bytes en vez de descomprimir el snapshot entero.
+            # En la tabla de archivo se aplica también a sus particiones, actuales y futuras
+            with db.engine.connect() as conn:
+                for tabla in ('snapshots_ranking', 'snapshots_ranking_archivo'):
+                    conn.execute(text(f'ALTER TABLE {tabla} ALTER COLUMN posiciones SET STORAGE EXTERNAL'))
+                conn.commit()
+            print("✅ Snapshots de ranking: posiciones sin comprimir (STORAGE EXTERNAL)")
+
     except Exception as e:
         print(f"Migración tablas: {e}")
 
+    try:
+        # Temporadas archivadas antes de que se archivaran también los snapshots del ranking
+        for temporada in Temporada.query.filter_by(archivada=True).all():
+            pendientes = db.session.query(SnapshotRanking.id).filter(
+                SnapshotRanking.club_id == temporada.club_id,
+                SnapshotRanking.pozo_jugado_id.in_(_pozos_de_temporada(temporada))).first()
+            if pendientes:
+                _crear_particiones(temporada.id)
+                movidos = _mover_al_archivo(SnapshotRanking, temporada)
+                db.session.commit()
+                print(f"✅ {movidos} snapshots de la temporada {temporada.nombre} archivados")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Migración snapshots archivados: {e}")
+
+    # Tablas de antes de AUTOINCREMENT en SQLite: tras archivar una temporada, las filas nuevas
+    # repetían ids del archivo. Se rehacen con AUTOINCREMENT y, si ya hay ids repetidos entre
+    # temporadas archivadas y la tabla caliente, se desplazan para que sean únicos
+    if db.engine.dialect.name == 'sqlite':
+        for modelo, archivo in ARCHIVOS.items():
+            tabla, tabla_archivo = modelo.__tablename__, archivo.__tablename__
+            try:
+                with db.engine.begin() as conn:
+                    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"),
+                                       {'t': tabla}).scalar()
+                    if 'AUTOINCREMENT' in sql.upper():
+                        continue
+
+                    tope = 0
+                    for temporada_id, minimo, maximo in conn.execute(text(
+                            f'SELECT temporada_id, MIN(id), MAX(id) FROM {tabla_archivo} '
+                            'GROUP BY temporada_id ORDER BY temporada_id')).all():
+                        if minimo <= tope:
+                            # En dos pasos para no chocar con la clave primaria a mitad del UPDATE
+                            conn.execute(text(f'UPDATE {tabla_archivo} SET id = -(id + :d) WHERE temporada_id = :t'),
+                                         {'d': tope, 't': temporada_id})
+                            conn.execute(text(f'UPDATE {tabla_archivo} SET id = -id WHERE temporada_id = :t'),
+                                         {'t': temporada_id})
+                            maximo += tope
+                        tope = max(tope, maximo)
+                    minimo = conn.execute(text(f'SELECT MIN(id) FROM {tabla}')).scalar()
+                    desplazamiento = tope if minimo is not None and minimo <= tope else 0
+
+                    conn.execute(text(f'ALTER TABLE {tabla} RENAME TO {tabla}_anterior'))
+                    for indice, in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                     "AND tbl_name = :t AND sql IS NOT NULL"),
+                                                {'t': f'{tabla}_anterior'}).all():
+                        conn.execute(text(f'DROP INDEX {indice}'))
+                    modelo.__table__.create(conn)
+                    columnas = [c.name for c in modelo.__table__.c]
+                    origen = [f'id + {int(desplazamiento)}' if c == 'id' else c for c in columnas]
+                    conn.execute(text(f'INSERT INTO {tabla} ({", ".join(columnas)}) '
+                                      f'SELECT {", ".join(origen)} FROM {tabla}_anterior'))
+                    conn.execute(text(f'DROP TABLE {tabla}_anterior'))
+
+                    ultimo = conn.execute(text(f'SELECT MAX(id) FROM {tabla}')).scalar() or 0
+                    conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :t'), {'t': tabla})
+                    conn.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:t, :s)'),
+                                 {'t': tabla, 's': max(ultimo, tope)})
+                print(f"✅ Tabla {tabla} con AUTOINCREMENT")
+            except Exception as e:
+                print(f"Migración AUTOINCREMENT {tabla}: {e}")
+
+TIEMPOS_ARRANQUE['migraciones'] = time.perf_counter() - _inicio_migraciones
+TIEMPOS_ARRANQUE['total'] = time.perf_counter() - _inicio_arranque
+
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,50 @@
+"""
+Benchmark del buscador de jugadores (índice en memoria de busqueda.py)
+Mide cuánto tarda en construirse el índice y cada búsqueda con distintos números de socios
+El objetivo del autocompletado del panel de admin es quedar por debajo de 50 ms
+Uso: python benchmark_busqueda.py [repeticiones]
+"""
+import random
+import string
+import sys
+import time
+
+from busqueda import IndiceJugadores
+
+NOMBRES = ['José', 'María', 'Ángel', 'Lucía', 'Javier', 'Álvaro', 'Núria', 'Iñigo', 'Pedro', 'Ana',
+           'Carmen', 'Raúl', 'Sofía', 'Martín', 'Elena', 'Andrés', 'Paula', 'Héctor', 'Irene', 'Óscar']
+APELLIDOS = ['García', 'Núñez', 'López', 'Martínez', 'Sánchez', 'Pérez', 'Gómez', 'Fernández', 'Ruiz',
+             'Díaz', 'Jiménez', 'Moreno', 'Muñoz', 'Álvarez', 'Romero', 'Gutiérrez', 'Navarro', 'Torres']
+CONSULTAS = ['jose', 'garcia lopez', 'a', 'nunez', 'nunes', 'javer martines', 'inigo', 'xqzv']
+
+
+def jugadores_aleatorios(n, semilla=42):
+    azar = random.Random(semilla)
+    return [(
+        i,
+        f'{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)} {azar.choice(APELLIDOS)}',
+        ''.join(azar.choices(string.ascii_lowercase, k=8)) + azar.choice(['@gmail.com', '@hotmail.com'])
+    ) for i in range(n)]
+
+
+def benchmark(repeticiones=5):
+    print(f"{'Socios':>8} {'Índice (s)':>11} {'Mejor (ms)':>11} {'Peor (ms)':>10}  Consulta más lenta")
+    for n in (1000, 10000, 50000):
+        inicio = time.perf_counter()
+        indice = IndiceJugadores(jugadores_aleatorios(n))
+        construccion = time.perf_counter() - inicio
+
+        tiempos = {}
+        for consulta in CONSULTAS:
+            muestras = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                indice.buscar(consulta)
+                muestras.append((time.perf_counter() - inicio) * 1000)
+            tiempos[consulta] = min(muestras)
+        lenta = max(tiempos, key=tiempos.get)
+        print(f"{n:>8} {construccion:>11.2f} {min(tiempos.values()):>11.2f} {tiempos[lenta]:>10.2f}  {lenta!r}")
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
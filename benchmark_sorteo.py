@@ -0,0 +1,37 @@
+"""
+Benchmark del sorteo de parejas y pistas
+Mide cuánto tarda generar_sorteo() con distintos números de jugadores
+Uso: python benchmark_sorteo.py [repeticiones]
+"""
+import random
+import sys
+import time
+
+from sorteo import generar_sorteo
+
+
+def jugadores_aleatorios(n, semilla=42):
+    azar = random.Random(semilla)
+    return [{
+        'id': i,
+        'nombre': f'Jugador {i}',
+        'nivel': round(azar.uniform(1.5, 5.5), 2),
+        'posicion': azar.choice(['derecha', 'izquierda', 'ambos', None])
+    } for i in range(n)]
+
+
+def benchmark(repeticiones=5):
+    print(f"{'Jugadores':>10} {'Pistas':>7} {'Mejor (ms)':>11} {'Media (ms)':>11} {'Desv. pistas':>13}")
+    for n in (16, 32, 64, 96, 128, 256):
+        jugadores = jugadores_aleatorios(n)
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            sorteo = generar_sorteo(jugadores)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        print(f"{n:>10} {len(sorteo['pistas']):>7} {min(tiempos):>11.2f} "
+              f"{sum(tiempos) / len(tiempos):>11.2f} {sorteo['desviacion']:>13.3f}")
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,65 @@
+"""
+Benchmark de SQLite: ajustes de producción (SQLITE_PRAGMAS en app.py) frente a los de serie
+Ejecuta dos veces la misma prueba de carga (prueba_carga.py, misma semilla y mismos datos),
+una con SQLITE_AJUSTES=off y otra con los ajustes, mientras el admin sube varios pozos,
+y compara rendimiento, latencias, esperas de bloqueo y errores
+
+Uso:
+    python benchmark_sqlite.py
+    python benchmark_sqlite.py --usuarios 100 --duracion 60 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+MODOS = {'de serie': 'off', 'ajustado': 'on'}
+
+
+def ejecutar(modo, args):
+    salida = tempfile.mktemp(suffix='.json')
+    orden = [sys.executable, 'prueba_carga.py',
+             '--usuarios', str(args.usuarios), '--duracion', str(args.duracion),
+             '--workers', str(args.workers), '--subidas', str(args.subidas),
+             '--pausa', str(args.pausa), '--semilla', str(args.semilla),
+             '--env', f'SQLITE_AJUSTES={MODOS[modo]}', '--json', salida]
+    print(f"▶️  SQLite {modo}...")
+    subprocess.run(orden, cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(salida) as f:
+        resultado = json.load(f)
+    os.remove(salida)
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara SQLite con y sin los ajustes de producción')
+    parser.add_argument('--usuarios', type=int, default=50)
+    parser.add_argument('--duracion', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--subidas', type=int, default=5, help='Pozos subidos durante cada prueba')
+    parser.add_argument('--pausa', type=float, default=0.2)
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    resultados = {modo: ejecutar(modo, args) for modo in MODOS}
+
+    def fila(nombre, valor, formato='{:.1f}'):
+        print(f"{nombre:<34}" + ''.join(f"{formato.format(valor(r)):>12}" for r in resultados.values()))
+
+    print(f"\n{'':<34}" + ''.join(f"{modo:>12}" for modo in resultados))
+    fila('Peticiones/s', lambda r: r['peticiones_por_segundo'])
+    fila('Errores', lambda r: r['errores'], '{}')
+    fila("'database is locked'", lambda r: r['database_is_locked'], '{}')
+    fila('Esperas de bloqueo', lambda r: r['esperas_bloqueo'], '{}')
+    fila('Tiempo en esperas (s)', lambda r: r['tiempo_esperas_bloqueo'], '{:.2f}')
+    fila('Escrituras p99 (ms)', lambda r: r['escrituras']['p99'])
+    for pagina in ('/ranking', '/estadisticas', '/pozos', '/dashboard', 'subir_resultados'):
+        for p in ('p95', 'p99'):
+            fila(f'{pagina} {p} (ms)', lambda r: r['paginas'].get(pagina, {}).get(p, 0))
+
+
+if __name__ == '__main__':
+    main()
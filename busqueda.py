@@ -0,0 +1,112 @@
+"""
+Búsqueda de jugadores por nombre y email, sin distinguir acentos ni mayúsculas
+("jose" encuentra a "José"). La usa app.py en SQLite; en Postgres la misma búsqueda
+se hace con un índice de trigramas (pg_trgm) sobre Usuario.busqueda
+
+Dos pasadas:
+- prefijo: cada palabra de la consulta es el principio de alguna palabra del jugador
+- aproximada: trigramas en común para erratas, solo si faltan resultados. Es la misma
+  medida que word_similarity() de pg_trgm: qué parte de los trigramas de la consulta
+  aparecen en el jugador, así un apellido mal escrito no se diluye en el nombre completo
+"""
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+
+UMBRAL_SIMILITUD = 0.6  # el word_similarity_threshold por defecto de pg_trgm
+
+_SEPARADORES = re.compile(r'[^a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos: 'José Núñez' -> 'jose nunez'."""
+    if texto and texto.isascii():
+        return texto.lower().strip()
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower().strip()
+
+
+def palabras(texto):
+    return [p for p in _SEPARADORES.split(normalizar(texto)) if p]
+
+
+def _trigramas_de(lista_palabras):
+    resultado = set()
+    for palabra in lista_palabras:
+        relleno = f'  {palabra} '
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+def trigramas(texto):
+    """Trigramas por palabra con relleno, igual que pg_trgm: 'ana' -> '  a', ' an', 'ana', 'na '."""
+    return _trigramas_de(palabras(texto))
+
+
+class IndiceJugadores:
+    """Índice en memoria de (id, nombre, email). Se reconstruye entero cuando cambian los usuarios."""
+
+    def __init__(self, jugadores):
+        claves = []
+        self._trigramas = {}
+        self._num_trigramas = {}
+        for jugador_id, nombre, email in jugadores:
+            email = normalizar(email)
+            # Sin el dominio: 'gmail' lo compartirían casi todos y solo añadiría ruido
+            propias = [p for p in _SEPARADORES.split(f'{normalizar(nombre)} {email.split("@")[0]}') if p]
+            # El email completo también como palabra, para poder escribir "ana.g@gm..."
+            for palabra in set(propias + [email]):
+                claves.append((palabra, jugador_id))
+            tris = _trigramas_de(propias)
+            self._num_trigramas[jugador_id] = len(tris)
+            for tri in tris:
+                if tri in self._trigramas:
+                    self._trigramas[tri].append(jugador_id)
+                else:
+                    self._trigramas[tri] = [jugador_id]
+        claves.sort()
+        self._palabras = [palabra for palabra, _ in claves]
+        self._ids = [jugador_id for _, jugador_id in claves]
+
+    def __len__(self):
+        return len(self._num_trigramas)
+
+    def _por_prefijo(self, prefijo):
+        inicio = bisect_left(self._palabras, prefijo)
+        ids = set()
+        for i in range(inicio, len(self._palabras)):
+            if not self._palabras[i].startswith(prefijo):
+                break
+            ids.add(self._ids[i])
+        return ids
+
+    def buscar(self, consulta, limite=10):
+        """Ids de los jugadores que encajan, los mejores primero."""
+        # Con '@' se está escribiendo un email: se busca como prefijo del email completo
+        terminos = [normalizar(consulta)] if '@' in consulta else palabras(consulta)
+        if not terminos or not terminos[0]:
+            return []
+
+        encontrados = None
+        for termino in sorted(terminos, key=len, reverse=True):
+            ids = self._por_prefijo(termino)
+            encontrados = ids if encontrados is None else encontrados & ids
+            if not encontrados:
+                break
+        resultado = sorted(encontrados or [])[:limite]
+        if len(resultado) >= limite:
+            return resultado
+
+        # Aproximada: parte de los trigramas de la consulta que tiene cada jugador
+        tris = trigramas(consulta)
+        comunes = Counter(chain.from_iterable(self._trigramas.get(tri, ()) for tri in tris))
+        minimo = UMBRAL_SIMILITUD * len(tris)
+        puntuados = []
+        for jugador_id, n in comunes.items():
+            if n >= minimo and jugador_id not in encontrados:
+                # A igual similitud, primero los nombres más cortos (más parecidos en conjunto)
+                puntuados.append((-n, self._num_trigramas[jugador_id], jugador_id))
+        puntuados.sort()
+        return resultado + [jugador_id for _, _, jugador_id in puntuados[:limite - len(resultado)]]
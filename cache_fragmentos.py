@@ -0,0 +1,206 @@
+"""
+Caché de fragmentos para las plantillas Jinja
+Uso en plantilla:
+
+    {% cache 'top_ranking', version_datos('ranking') %} ... {% endcache %}
+    {% cache 'proximos_pozos', version_datos('pozos'), mi_nivel, ttl=60 %} ... {% endcache %}
+
+La clave es el nombre más las dependencias explícitas: cuando cambia una de ellas
+(p. ej. la versión del ranking) se genera otra clave y el fragmento se vuelve a renderizar.
+Si environment.cache_fragmentos_prefijo es una función, lo que devuelva va delante de
+todas las claves (p. ej. el club actual, para que cada club tenga sus fragmentos).
+
+Las claves de versiones anteriores no se vuelven a leer nunca: en los backends compartidos
+(disco y redis) todo caduca como mucho a las ttl_por_defecto, aunque el fragmento no lleve ttl.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class CacheLRU:
+    """Caché en memoria del proceso, con las entradas menos usadas descartadas primero.
+
+    Con max_bytes también se descartan entradas mientras los valores (texto, en UTF-8)
+    ocupen más de eso en total.
+    """
+
+    def __init__(self, max_entradas=1024, max_bytes=None):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _quitar(self, clave):
+        _, _, tamano = self._datos.pop(clave)
+        self._bytes -= tamano
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, expira, _ = entrada
+            if expira is not None and expira < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor, ttl=None):
+        expira = time.monotonic() + ttl if ttl else None
+        tamano = len(valor.encode('utf-8')) if self.max_bytes and isinstance(valor, str) else 0
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+            self._datos[clave] = (valor, expira, tamano)
+            self._bytes += tamano
+            while self._datos and (len(self._datos) > self.max_entradas or
+                                   (self.max_bytes and self._bytes > self.max_bytes)):
+                self._quitar(next(iter(self._datos)))
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+
+TTL_COMPARTIDA = 24 * 60 * 60
+
+
+class CacheDisco:
+    """Caché compartida entre los workers de una misma máquina, en ficheros.
+
+    Sirve como sustituto local de Redis (p. ej. gunicorn con varios workers en desarrollo).
+    Los ficheros caducados se borran con purgar().
+    """
+
+    def __init__(self, directorio=None, ttl_por_defecto=TTL_COMPARTIDA):
+        self.directorio = directorio or os.path.join(tempfile.gettempdir(), 'lapecera_fragmentos')
+        self.ttl_por_defecto = ttl_por_defecto
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, hashlib.sha1(clave.encode()).hexdigest())
+
+    def get(self, clave):
+        try:
+            with open(self._ruta(clave), encoding='utf-8') as f:
+                expira = float(f.readline())
+                if expira and expira < time.time():
+                    return None
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def set(self, clave, valor, ttl=None):
+        ttl = ttl or self.ttl_por_defecto
+        ruta = self._ruta(clave)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(f'{time.time() + ttl if ttl else 0}\n')
+            f.write(valor)
+        os.replace(temporal, ruta)
+
+    def purgar(self):
+        """Borra los ficheros caducados. Devuelve cuántos."""
+        borrados, ahora = 0, time.time()
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    expira = float(f.readline())
+                if expira and expira < ahora:
+                    os.remove(ruta)
+                    borrados += 1
+            except (OSError, ValueError):
+                pass
+        return borrados
+
+    def clear(self):
+        for nombre in os.listdir(self.directorio):
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except OSError:
+                pass
+
+
+class CacheRedis:
+    """Caché compartida entre todos los workers y máquinas. Requiere el paquete redis."""
+
+    def __init__(self, url, prefijo='fragmento:', ttl_por_defecto=TTL_COMPARTIDA):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+        self.prefijo = prefijo
+        self.ttl_por_defecto = ttl_por_defecto
+
+    def get(self, clave):
+        valor = self.cliente.get(self.prefijo + clave)
+        return valor.decode('utf-8') if valor is not None else None
+
+    def set(self, clave, valor, ttl=None):
+        ttl = ttl or self.ttl_por_defecto
+        self.cliente.set(self.prefijo + clave, valor.encode('utf-8'), ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for clave in self.cliente.scan_iter(self.prefijo + '*'):
+            self.cliente.delete(clave)
+
+
+def crear_backend(tipo, **opciones):
+    """'memoria' (por defecto), 'disco', 'redis' u 'off' para desactivar la caché."""
+    if tipo == 'off':
+        return None
+    ttl = int(opciones.get('ttl') or TTL_COMPARTIDA)
+    if tipo == 'disco':
+        return CacheDisco(opciones.get('directorio'), ttl_por_defecto=ttl)
+    if tipo == 'redis':
+        return CacheRedis(opciones['url'], ttl_por_defecto=ttl)
+    return CacheLRU(opciones.get('max_entradas', 1024))
+
+
+class CacheFragmentos(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(cache_fragmentos=None, cache_fragmentos_prefijo=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        dependencias = [parser.parse_expression()]
+        ttl = nodes.Const(None)
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.test('name:ttl') and parser.stream.look().test('assign'):
+                next(parser.stream)
+                next(parser.stream)
+                ttl = parser.parse_expression()
+                break
+            dependencias.append(parser.parse_expression())
+
+        cuerpo = parser.parse_statements(('name:endcache',), drop_needle=True)
+        llamada = self.call_method('_renderizar', [nodes.List(dependencias), ttl])
+        return nodes.CallBlock(llamada, [], [], cuerpo).set_lineno(lineno)
+
+    def _renderizar(self, dependencias, ttl, caller):
+        backend = self.environment.cache_fragmentos
+        if backend is None:
+            return caller()
+
+        clave = ':'.join(str(d) for d in dependencias)
+        if self.environment.cache_fragmentos_prefijo is not None:
+            clave = f'{self.environment.cache_fragmentos_prefijo()}:{clave}'
+        html = backend.get(clave)
+        if html is None:
+            html = str(caller())
+            backend.set(clave, html, ttl)
+        return Markup(html)
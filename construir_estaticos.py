@@ -0,0 +1,96 @@
+"""
+Construcción de los estáticos (CSS de Tailwind y Chart.js)
+Genera en static/dist/ un CSS de Tailwind compilado, purgado y minificado con las clases
+de templates/, y una copia local de Chart.js, con el hash del contenido en el nombre
+La app los sirve con caché inmutable; si no existen, base.html vuelve a usar los CDN
+
+Uso: python construir_estaticos.py
+(en Render se ejecuta en el buildCommand, ver render.yaml)
+"""
+import hashlib
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import urllib.request
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+DIST = os.path.join(BASE, 'static', 'dist')
+CACHE = os.path.join(BASE, '.cache')
+
+TAILWIND_VERSION = '3.4.17'
+CHARTJS_VERSION = '4.4.1'
+CHARTJS_URL = f'https://cdn.jsdelivr.net/npm/chart.js@{CHARTJS_VERSION}/dist/chart.umd.min.js'
+
+
+def _descargar(url, destino):
+    if not os.path.exists(destino):
+        print(f"⬇️  {url}")
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=60) as respuesta, open(destino + '.tmp', 'wb') as f:
+            shutil.copyfileobj(respuesta, f)
+        os.replace(destino + '.tmp', destino)
+    return destino
+
+
+def _tailwind_cli():
+    """Usa el binario tailwindcss del PATH o descarga el ejecutable standalone."""
+    if shutil.which('tailwindcss'):
+        return shutil.which('tailwindcss')
+
+    sistema = {'Linux': 'linux', 'Darwin': 'macos'}.get(platform.system())
+    arquitectura = {'x86_64': 'x64', 'AMD64': 'x64', 'arm64': 'arm64', 'aarch64': 'arm64'}.get(platform.machine())
+    if not sistema or not arquitectura:
+        raise SystemExit(f"❌ Instala tailwindcss v{TAILWIND_VERSION} manualmente para {platform.system()}")
+
+    nombre = f'tailwindcss-{sistema}-{arquitectura}'
+    binario = _descargar(
+        f'https://github.com/tailwindlabs/tailwindcss/releases/download/v{TAILWIND_VERSION}/{nombre}',
+        os.path.join(CACHE, f'{nombre}-{TAILWIND_VERSION}')
+    )
+    os.chmod(binario, os.stat(binario).st_mode | stat.S_IEXEC)
+    return binario
+
+
+def _publicar(origen, nombre, extension):
+    """Copia el fichero a static/dist/ con el hash del contenido en el nombre."""
+    with open(origen, 'rb') as f:
+        huella = hashlib.sha256(f.read()).hexdigest()[:12]
+    destino = f'{nombre}.{huella}.{extension}'
+    shutil.copyfile(origen, os.path.join(DIST, destino))
+    return destino
+
+
+def construir():
+    if os.path.isdir(DIST):
+        shutil.rmtree(DIST)
+    os.makedirs(DIST)
+
+    css = os.path.join(CACHE, 'app.css')
+    os.makedirs(CACHE, exist_ok=True)
+    subprocess.run([
+        _tailwind_cli(),
+        '--config', os.path.join(BASE, 'tailwind.config.js'),
+        '--input', os.path.join(BASE, 'static', 'src', 'app.css'),
+        '--output', css,
+        '--minify'
+    ], cwd=BASE, check=True)
+
+    chartjs = _descargar(CHARTJS_URL, os.path.join(CACHE, f'chart-{CHARTJS_VERSION}.umd.min.js'))
+
+    manifiesto = {
+        'app.css': _publicar(css, 'app', 'css'),
+        'chart.js': _publicar(chartjs, 'chart', 'js'),
+    }
+    with open(os.path.join(DIST, 'manifest.json'), 'w') as f:
+        json.dump(manifiesto, f, indent=2)
+
+    for logico, fichero in manifiesto.items():
+        tamano = os.path.getsize(os.path.join(DIST, fichero)) / 1024
+        print(f"✅ {logico:<10} → static/dist/{fichero} ({tamano:.1f} KB)")
+
+
+if __name__ == '__main__':
+    construir()
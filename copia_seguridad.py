@@ -0,0 +1,74 @@
+"""
+Copia de seguridad en caliente de la base de datos SQLite
+Usa la API de backup de SQLite: copia la base por tandas de páginas mientras la app sigue
+funcionando. Con WAL (ver SQLITE_PRAGMAS en app.py) los lectores no esperan nunca, y una
+escritura solo espera lo que tarda una tanda
+
+Uso:
+    python copia_seguridad.py                       # copias/padel_club-AAAAMMDD-HHMMSS.db
+    python copia_seguridad.py --destino /ruta/copia.db
+    python copia_seguridad.py --conservar 7         # borra las copias más antiguas
+
+Con Postgres (DATABASE_URL) no hace nada: las copias las hace Render, o pg_dump.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from app import app, db
+
+
+def copiar(origen, destino, paginas=256, pausa=0.005):
+    """Copia origen en destino por tandas de páginas, soltando el bloqueo entre tandas."""
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+    try:
+        fuente.backup(copia, pages=paginas, sleep=pausa)
+        # La copia queda como fichero único, sin WAL al lado
+        copia.execute('PRAGMA journal_mode = DELETE')
+        resultado = copia.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        copia.close()
+        fuente.close()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copia de seguridad de la base SQLite sin parar la app')
+    parser.add_argument('--destino', help='Fichero de la copia (por defecto, en copias/ con la fecha)')
+    parser.add_argument('--paginas', type=int, default=256, help='Páginas por tanda (0: todas de una vez)')
+    parser.add_argument('--conservar', type=int, help='Copias de copias/ que se conservan; el resto se borran')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            print("ℹ️  La base de datos no es SQLite: usa las copias de Render o pg_dump")
+            return
+        origen = db.engine.url.database
+
+    directorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'copias')
+    nombre = os.path.splitext(os.path.basename(origen))[0]
+    destino = args.destino
+    if not destino:
+        os.makedirs(directorio, exist_ok=True)
+        destino = os.path.join(directorio, f"{nombre}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+
+    inicio = time.perf_counter()
+    resultado = copiar(origen, destino, paginas=args.paginas or -1)
+    if resultado != 'ok':
+        raise SystemExit(f"❌ La copia no pasa la comprobación de integridad: {resultado}")
+    tamano = os.path.getsize(destino) / 1024 / 1024
+    print(f"✅ Copia en {destino} ({tamano:.1f} MB, {time.perf_counter() - inicio:.2f} s)")
+
+    if args.conservar:
+        copias = sorted(glob.glob(os.path.join(directorio, f'{nombre}-*.db')))
+        for antigua in copias[:-args.conservar]:
+            os.remove(antigua)
+            print(f"🗑️  Borrada {os.path.basename(antigua)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Script para dar de alta un club nuevo en el mismo despliegue
+Cada club tiene sus propios jugadores, pozos, ranking y temporadas.
+Los jugadores se registran con el enlace que se muestra al final, y el primer
+admin del club se nombra después con hacer_admin.py
+"""
+import re
+
+from app import app, db, Club
+
+
+def crear_club():
+    with app.app_context():
+        nombre = input("Nombre del club: ").strip()
+        slug = input("Identificador para los enlaces (p. ej. padel-norte): ").strip().lower()
+        dominio = input("Dominio propio (opcional, Enter para ninguno): ").strip().lower() or None
+
+        if not nombre or not re.fullmatch(r'[a-z0-9-]+', slug):
+            print("❌ Hace falta un nombre y un identificador con solo letras, números y guiones")
+            return
+        if Club.query.filter_by(slug=slug).first():
+            print(f"❌ Ya existe un club con el identificador: {slug}")
+            return
+        if dominio and Club.query.filter_by(dominio=dominio).first():
+            print(f"❌ Ya hay un club con el dominio: {dominio}")
+            return
+
+        club = Club(nombre=nombre, slug=slug, dominio=dominio)
+        db.session.add(club)
+        db.session.commit()
+        print(f"✅ Club {club.nombre} creado (id {club.id})")
+        print(f"   Enlace de registro: /registro?club={club.slug}")
+        if dominio:
+            print(f"   O directamente en https://{dominio}")
+
+if __name__ == '__main__':
+    crear_club()
@@ -2,7 +2,7 @@
 Script para convertir un usuario en administrador
 Ejecuta esto una sola vez para hacerte admin
 """
-from app import app, db, Usuario
+from app import app, db, Usuario, buscar_usuarios, en_club, incrementar_version, incrementar_version_personal
 
 def hacer_admin():
     with app.app_context():
@@ -13,14 +13,20 @@ def hacer_admin():
         
         if usuario:
             usuario.es_admin = True
+            # Sus páginas personales cacheadas (ETag) no llevan todavía el menú de admin
+            incrementar_version_personal(usuario)
+            # Y lo que se cachea con la lista de usuarios es del club del usuario, no de la petición
+            with en_club(usuario.club_id):
+                incrementar_version('usuarios')
             db.session.commit()
             print(f"✅ ¡{usuario.nombre} ahora es administrador!")
         else:
             print(f"❌ No se encontró ningún usuario con el email: {email}")
-            print("\nUsuarios registrados:")
-            todos = Usuario.query.all()
-            for u in todos:
-                print(f"  - {u.nombre} ({u.email})")
+            parecidos = buscar_usuarios(email.split('@')[0])
+            if parecidos:
+                print("\n¿Quizá alguno de estos?")
+                for u in parecidos:
+                    print(f"  - {u.nombre} ({u.email})")
 
 if __name__ == '__main__':
     hacer_admin()
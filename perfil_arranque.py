@@ -0,0 +1,87 @@
+"""
+Informe de tiempo de arranque de la app
+Arranca app.py en un proceso limpio con `python -X importtime` y muestra cuánto
+tardan los imports, la creación de la app y las migraciones, y qué paquetes pesan más
+
+Uso:
+    python perfil_arranque.py                    # informe
+    python perfil_arranque.py --presupuesto 1.5  # falla (código 1) si el arranque supera 1.5 s
+
+Con --presupuesto sirve como comprobación en CI o antes de desplegar en Render.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MARCA = '@@ARRANQUE@@'
+
+CODIGO = f'''
+import sys, json
+import app
+perezosos = [m for m in ('cloudinary', 'sendgrid') if m in sys.modules]
+print({MARCA!r} + json.dumps({{'tiempos': app.TIEMPOS_ARRANQUE, 'cargados': perezosos}}))
+'''
+
+
+def medir():
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    proceso = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CODIGO],
+        cwd=directorio, capture_output=True, text=True
+    )
+    if proceso.returncode != 0:
+        raise SystemExit(f"❌ La app no arranca:\n{proceso.stderr[-2000:]}")
+
+    linea = next(l for l in proceso.stdout.splitlines() if l.startswith(MARCA))
+    datos = json.loads(linea[len(MARCA):])
+
+    # Formato de -X importtime: "import time: self [us] | cumulative | paquete", con los
+    # hijos antes que el padre y sangrados dos espacios por nivel. Nos quedamos con los
+    # imports directos de app.py
+    paquetes, pendientes = [], []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        nivel = (len(nombre) - len(nombre.lstrip(' ')) - 1) // 2
+        if nivel == 1:
+            pendientes.append((int(acumulado) / 1e6, nombre.strip()))
+        elif nivel == 0:
+            if nombre.strip() == 'app':
+                paquetes = pendientes
+            pendientes = []
+    paquetes.sort(reverse=True)
+
+    return datos['tiempos'], datos['cargados'], paquetes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide el tiempo de arranque de app.py')
+    parser.add_argument('--presupuesto', type=float, help='Tiempo máximo de arranque en segundos')
+    parser.add_argument('--top', type=int, default=10, help='Paquetes más lentos a mostrar')
+    args = parser.parse_args()
+
+    tiempos, cargados, paquetes = medir()
+
+    print("⏱️  Arranque de app.py")
+    for fase in ('imports', 'app', 'migraciones', 'total'):
+        print(f"  {fase:<12} {tiempos[fase] * 1000:>8.1f} ms")
+
+    print("\n📦 Imports de app.py más pesados (acumulado)")
+    for segundos, nombre in paquetes[:args.top]:
+        print(f"  {nombre:<30} {segundos * 1000:>8.1f} ms")
+
+    if cargados:
+        print(f"\n⚠️  Se cargan al arrancar aunque deberían ser perezosos: {', '.join(cargados)}")
+
+    if args.presupuesto is not None:
+        if tiempos['total'] > args.presupuesto or cargados:
+            print(f"\n❌ Arranque {tiempos['total']:.2f}s (presupuesto {args.presupuesto:.2f}s)")
+            sys.exit(1)
+        print(f"\n✅ Arranque {tiempos['total']:.2f}s dentro del presupuesto ({args.presupuesto:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+Prueba de carga del pico de tráfico de después de un pozo
+Siembra una base de datos con socios e historial, arranca la app con gunicorn y
+reproduce lo que pasa al publicar resultados: muchos socios entran a mirar /ranking,
+/estadisticas, /pozos y /dashboard mientras un admin sube los resultados del pozo.
+Todo en local (SQLite en un directorio temporal salvo que se pase --base-datos)
+
+Uso:
+    python prueba_carga.py                                  # 50 socios, 2 workers sync, 30 s
+    python prueba_carga.py --usuarios 200 --workers 4 --worker-class gthread --threads 4
+    python prueba_carga.py --env CACHE_FRAGMENTOS=off --json sin_cache.json
+    python prueba_carga.py --env DB_POOL_SIZE=2 --env DB_MAX_OVERFLOW=0
+
+Informe: peticiones por segundo, latencias p50/p95/p99/máx por página, errores, y las
+escrituras en la base de datos medidas dentro de cada worker. Una escritura de unas
+pocas filas tarda milisegundos; las que superan UMBRAL_BLOQUEO_MS son tiempo esperando
+el bloqueo de la base de datos (en SQLite, el de todo el fichero).
+
+Con la misma --semilla se siembran los mismos datos y cada socio virtual hace la misma
+secuencia de páginas, así que dos ejecuciones solo difieren en lo que se cambia.
+Este mismo fichero hace de configuración de gunicorn (-c) para medir en los workers.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Qué mira un socio tras un pozo, con su peso
+PAGINAS = {'/ranking': 35, '/estadisticas': 30, '/pozos': 20, '/dashboard': 15}
+UMBRAL_BLOQUEO_MS = 50
+DOMINIO = 'carga.test'
+PASSWORD = 'carga-secreta'
+
+
+# ── MEDICIÓN DENTRO DE LOS WORKERS (hooks de gunicorn) ───────────────────────
+
+_escrituras = []
+
+
+def post_fork(server, worker):
+    """Mide en cada worker la duración de INSERT/UPDATE/DELETE y de cada COMMIT."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.orm import Session
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _antes(conn, cursor, sentencia, parametros, contexto, varios):
+        conn.info['inicio_sentencia'] = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _despues(conn, cursor, sentencia, parametros, contexto, varios):
+        if sentencia.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            _escrituras.append(time.perf_counter() - conn.info.pop('inicio_sentencia'))
+
+    # El COMMIT en sí (sin el flush, que ya se mide arriba sentencia a sentencia)
+    @event.listens_for(Session, 'before_commit')
+    @event.listens_for(Session, 'after_flush_postexec')
+    def _inicio_commit(sesion, *args):
+        sesion.info['inicio_commit'] = time.perf_counter()
+
+    @event.listens_for(Session, 'after_commit')
+    def _fin_commit(sesion):
+        if 'inicio_commit' in sesion.info:
+            _escrituras.append(time.perf_counter() - sesion.info.pop('inicio_commit'))
+
+
+def worker_exit(server, worker):
+    directorio = os.environ.get('PRUEBA_CARGA_METRICAS')
+    if directorio:
+        with open(os.path.join(directorio, f'worker_{os.getpid()}.json'), 'w') as f:
+            json.dump(_escrituras, f)
+
+
+# ── DATOS ────────────────────────────────────────────────────────────────────
+
+def email_socio(i):
+    return f'socio{i}@{DOMINIO}'
+
+
+def csv_pozo(azar, socios, jugadores=24):
+    """Resultados de un pozo con el formato de subir_resultados: parejas y podio."""
+    elegidos = azar.sample(range(socios), jugadores)
+    lineas = ['email1,nivel1,email2,nivel2,posicion']
+    for pareja in range(jugadores // 2):
+        a, b = elegidos[2 * pareja], elegidos[2 * pareja + 1]
+        posicion = pareja + 1 if pareja < 3 else ''
+        lineas.append(f'{email_socio(a)},{2.5 + (a % 30) / 10},{email_socio(b)},{2.5 + (b % 30) / 10},{posicion}')
+    return '\n'.join(lineas)
+
+
+def sembrar(socios, pozos, semilla):
+    """Crea socios, un admin, pozos próximos y un historial subido con la propia app."""
+    os.environ['PLANIFICADOR'] = 'off'
+    from app import app, db, Usuario, Pozo
+    from werkzeug.security import generate_password_hash
+
+    azar = random.Random(semilla)
+    with app.app_context():
+        if Usuario.query.filter_by(email=f'admin@{DOMINIO}').first():
+            print("📦 La base de datos ya tiene los datos de la prueba, no se siembra")
+            return
+        # Mismo hash para todos: calcularlo 1000 veces tardaría más que la prueba
+        hash_password = generate_password_hash(PASSWORD)
+        db.session.add(Usuario(nombre='Admin Carga', email=f'admin@{DOMINIO}', password_hash=hash_password,
+                               es_admin=True, acepta_terminos=True))
+        for i in range(socios):
+            db.session.add(Usuario(nombre=f'Socio {i}', email=email_socio(i), password_hash=hash_password,
+                                   nivel_playtomic=2.5 + (i % 30) / 10, acepta_terminos=True))
+        for i in range(5):
+            db.session.add(Pozo(titulo=f'Pozo próximo {i + 1}', nivel_min=2.5 + i * 0.5, nivel_max=3.5 + i * 0.5,
+                                enlace='https://example.com/pozo', fecha=datetime.utcnow() + timedelta(days=i + 1)))
+        db.session.commit()
+
+    cliente = app.test_client()
+    cliente.post('/login', data={'email': f'admin@{DOMINIO}', 'password': PASSWORD})
+    inicio = datetime.utcnow() - timedelta(weeks=pozos + 1)
+    for i in range(pozos):
+        respuesta = cliente.post('/admin/subir_resultados', data={
+            'titulo_pozo': f'Pozo histórico {i + 1}',
+            'fecha_pozo': (inicio + timedelta(weeks=i)).strftime('%Y-%m-%d'),
+            'csv_contenido': csv_pozo(azar, socios)
+        })
+        if respuesta.status_code != 302:
+            raise SystemExit(f"❌ No se pudo sembrar el pozo {i + 1}: {respuesta.status_code}")
+    print(f"📦 Sembrados {socios} socios y {pozos} pozos jugados")
+
+
+# ── SERVIDOR ─────────────────────────────────────────────────────────────────
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def arrancar_gunicorn(args, entorno, registro):
+    puerto = puerto_libre()
+    orden = [sys.executable, '-m', 'gunicorn', 'app:app',
+             '-c', os.path.abspath(__file__),
+             '-b', f'127.0.0.1:{puerto}',
+             '-w', str(args.workers),
+             '-k', args.worker_class,
+             '--threads', str(args.threads),
+             '--error-logfile', '-']
+    proceso = subprocess.Popen(orden, cwd=os.path.dirname(os.path.abspath(__file__)), env=entorno,
+                               stdout=registro, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{puerto}'
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise SystemExit(f"❌ gunicorn no ha arrancado, mira el registro: {registro.name}")
+        try:
+            urllib.request.urlopen(f'{url}/login', timeout=2).read()
+            return proceso, url
+        except OSError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise SystemExit("❌ gunicorn no responde tras 60 s")
+
+
+# ── CLIENTES VIRTUALES ───────────────────────────────────────────────────────
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    # Cada petición se mide sola: un 302 es la respuesta, no se sigue
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Cliente:
+    def __init__(self, url, metricas):
+        self.url = url
+        self.metricas = metricas
+        self.navegador = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SinRedirecciones)
+
+    def pedir(self, nombre, ruta, datos=None, esperado=200):
+        peticion = urllib.request.Request(
+            self.url + ruta,
+            data=urllib.parse.urlencode(datos).encode() if datos is not None else None,
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        inicio = time.perf_counter()
+        try:
+            with self.navegador.open(peticion, timeout=30) as respuesta:
+                respuesta.read()
+                estado = respuesta.status
+        except urllib.error.HTTPError as e:
+            estado = e.code
+        except OSError as e:
+            estado = type(e).__name__
+        self.metricas.anotar(nombre, time.perf_counter() - inicio, estado == esperado, estado)
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tiempos = defaultdict(list)
+        self.errores = defaultdict(lambda: defaultdict(int))
+
+    def anotar(self, nombre, duracion, correcta, estado):
+        with self._lock:
+            self.tiempos[nombre].append(duracion)
+            if not correcta:
+                self.errores[nombre][str(estado)] += 1
+
+
+def socio_virtual(url, metricas, numero, socios, args, fin):
+    azar = random.Random(args.semilla * 100003 + numero)
+    time.sleep(azar.uniform(0, args.rampa))
+    cliente = Cliente(url, metricas)
+    cliente.pedir('login', '/login', {'email': email_socio(numero % socios), 'password': PASSWORD}, esperado=302)
+    rutas, pesos = list(PAGINAS), list(PAGINAS.values())
+    while time.monotonic() < fin:
+        ruta = azar.choices(rutas, pesos)[0]
+        cliente.pedir(ruta, ruta)
+        if args.pausa:
+            time.sleep(azar.expovariate(1 / args.pausa))
+
+
+def admin_virtual(url, metricas, args, fin, inicio):
+    azar = random.Random(args.semilla)
+    cliente = Cliente(url, metricas)
+    cliente.pedir('login', '/login', {'email': f'admin@{DOMINIO}', 'password': PASSWORD}, esperado=302)
+    intervalo = (args.duracion - args.subida_en) / max(args.subidas, 1)
+    for i in range(args.subidas):
+        espera = inicio + args.subida_en + i * intervalo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        if time.monotonic() >= fin:
+            break
+        cliente.pedir('subir_resultados', '/admin/subir_resultados', {
+            'titulo_pozo': f'Pozo de la prueba {i + 1}',
+            'fecha_pozo': (datetime.utcnow() - timedelta(hours=args.subidas - i)).strftime('%Y-%m-%d'),
+            'csv_contenido': csv_pozo(azar, args.socios)
+        }, esperado=302)
+
+
+# ── INFORME ──────────────────────────────────────────────────────────────────
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+def resumen(tiempos):
+    ordenados = sorted(tiempos)
+    return {'n': len(ordenados), **{f'p{p}': percentil(ordenados, p) * 1000 for p in (50, 95, 99)},
+            'max': (ordenados[-1] if ordenados else 0) * 1000}
+
+
+def informe(metricas, duracion, escrituras, bloqueos_sqlite, args):
+    total = sum(len(t) for t in metricas.tiempos.values())
+    errores = sum(sum(e.values()) for e in metricas.errores.values())
+    print(f"\n🏁 {args.workers} workers {args.worker_class} x {args.threads} hilos, {args.usuarios} socios, "
+          f"{duracion:.1f} s {' '.join(args.env)}")
+    print(f"{'Página':<18} {'Peticiones':>10} {'Errores':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8}")
+    paginas = {}
+    for nombre in sorted(metricas.tiempos):
+        r = resumen(metricas.tiempos[nombre])
+        r['errores'] = dict(metricas.errores.get(nombre, {}))
+        paginas[nombre] = r
+        print(f"{nombre:<18} {r['n']:>10} {sum(r['errores'].values()):>8} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+              f"{r['p99']:>8.1f} {r['max']:>8.1f}")
+    print(f"\n  Rendimiento: {total / duracion:.1f} peticiones/s · errores: {errores} "
+          f"({errores / max(total, 1):.2%})")
+    for nombre, por_estado in metricas.errores.items():
+        print(f"    {nombre}: {dict(por_estado)}")
+
+    esc = resumen(escrituras)
+    lentas = [t for t in escrituras if t * 1000 >= UMBRAL_BLOQUEO_MS]
+    print(f"  Escrituras en BD: {esc['n']} (p50 {esc['p50']:.1f} ms, p99 {esc['p99']:.1f} ms, máx {esc['max']:.1f} ms)")
+    print(f"  Esperas de bloqueo (>= {UMBRAL_BLOQUEO_MS} ms): {len(lentas)}, {sum(lentas):.2f} s en total · "
+          f"'database is locked': {bloqueos_sqlite}")
+
+    return {
+        'configuracion': vars(args), 'duracion': duracion, 'peticiones': total, 'errores': errores,
+        'peticiones_por_segundo': total / duracion, 'paginas': paginas,
+        'escrituras': esc, 'esperas_bloqueo': len(lentas), 'tiempo_esperas_bloqueo': sum(lentas),
+        'database_is_locked': bloqueos_sqlite
+    }
+
+
+# ── PRINCIPAL ────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproduce el pico de tráfico tras un pozo contra gunicorn')
+    parser.add_argument('--usuarios', type=int, default=50, help='Socios conectados a la vez')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos de prueba')
+    parser.add_argument('--rampa', type=float, default=5, help='Segundos en los que van entrando los socios')
+    parser.add_argument('--pausa', type=float, default=0.5, help='Pausa media entre páginas (0: sin pausa)')
+    parser.add_argument('--subidas', type=int, default=1, help='Pozos que sube el admin durante la prueba')
+    parser.add_argument('--subida-en', type=float, default=3, help='Segundo en que se sube el primer pozo')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='sync', help='sync, gthread, gevent...')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--env', action='append', default=[], metavar='CLAVE=VALOR',
+                        help='Variable de entorno para la app (caché, pool...); se puede repetir')
+    parser.add_argument('--socios', type=int, default=500, help='Socios sembrados')
+    parser.add_argument('--pozos', type=int, default=30, help='Pozos jugados sembrados')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--base-datos', help='DATABASE_URL a usar en vez de un SQLite temporal')
+    parser.add_argument('--json', help='Guarda el resultado en este fichero para comparar ejecuciones')
+    args = parser.parse_args()
+
+    temporal = tempfile.mkdtemp(prefix='prueba_carga_')
+    metricas_workers = os.path.join(temporal, 'metricas')
+    os.makedirs(metricas_workers)
+    base_datos = args.base_datos or f"sqlite:///{os.path.join(temporal, 'carga.db')}"
+
+    entorno = dict(os.environ, DATABASE_URL=base_datos, PLANIFICADOR='off',
+                   NOTIFICACIONES_TRANSPORTE='local', PRUEBA_CARGA_METRICAS=metricas_workers)
+    for variable in args.env:
+        clave, _, valor = variable.partition('=')
+        entorno[clave] = valor
+    os.environ.update({k: v for k, v in entorno.items() if k != 'PRUEBA_CARGA_METRICAS'})
+
+    sembrar(args.socios, args.pozos, args.semilla)
+
+    ruta_registro = os.path.join(temporal, 'gunicorn.log')
+    with open(ruta_registro, 'w') as registro:
+        servidor, url = arrancar_gunicorn(args, entorno, registro)
+        metricas = Metricas()
+        try:
+            print(f"🚀 {url}: {args.usuarios} socios durante {args.duracion:.0f} s")
+            inicio = time.monotonic()
+            fin = inicio + args.duracion
+            hilos = [threading.Thread(target=socio_virtual, args=(url, metricas, i, args.socios, args, fin))
+                     for i in range(args.usuarios)]
+            hilos.append(threading.Thread(target=admin_virtual, args=(url, metricas, args, fin, inicio)))
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            duracion = time.monotonic() - inicio
+        finally:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+
+    escrituras = []
+    for nombre in os.listdir(metricas_workers):
+        with open(os.path.join(metricas_workers, nombre)) as f:
+            escrituras.extend(json.load(f))
+    with open(ruta_registro) as f:
+        bloqueos_sqlite = f.read().count('database is locked')
+
+    resultado = informe(metricas, duracion, escrituras, bloqueos_sqlite, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(resultado, f, indent=2)
+        print(f"\n💾 Resultado guardado en {args.json}")
+
+    if bloqueos_sqlite or resultado['errores']:
+        shutil.copy(ruta_registro, 'prueba_carga_gunicorn.log')
+        print("📄 Registro de gunicorn copiado a prueba_carga_gunicorn.log")
+    shutil.rmtree(temporal, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Reglas de variación de nivel y puntos tras un pozo
+Las usa subir_resultados() en app.py y el simulador de reglas (simulador_reglas.py)
+"""
+
+# Listas por posición: [1º, 2º, 3º, sin podio]
+REGLAS_PRODUCCION = {
+    'nombre': 'produccion',
+    'umbral': 0.3,
+    'debajo': [0.10, 0.08, 0.06, 0],
+    'media': [0.06, 0.04, 0.02, -0.01],
+    'encima': [0.04, 0.02, 0.01, -0.02],
+    'puntos': [10, 6, 4, 2],
+}
+
+NIVEL_MINIMO = 0
+NIVEL_MAXIMO = 7
+
+
+def variacion_y_puntos(media_pareja, media_pozo, posicion, reglas=REGLAS_PRODUCCION):
+    """Devuelve (variación de nivel, puntos de ranking) para una pareja."""
+    diferencia = media_pareja - media_pozo
+    if diferencia < -reglas['umbral']:
+        tabla = reglas['debajo']
+    elif diferencia > reglas['umbral']:
+        tabla = reglas['encima']
+    else:
+        tabla = reglas['media']
+
+    if posicion in (1, 2, 3):
+        return tabla[posicion - 1], reglas['puntos'][posicion - 1]
+    if posicion is None:
+        return tabla[3], reglas['puntos'][3]
+    # Posiciones fuera del podio con número: ni sube ni baja, puntos de participación
+    return 0, reglas['puntos'][3]
+
+
+def aplicar_variacion(nivel, variacion):
+    return max(NIVEL_MINIMO, min(NIVEL_MAXIMO, round(nivel + variacion, 2)))
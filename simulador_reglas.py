@@ -0,0 +1,191 @@
+"""
+Simulador "¿y si...?" de reglas de nivel y puntos
+Carga todo el historial de pozos una vez en arrays compactos y lo vuelve a jugar
+con reglas alternativas (en paralelo), comparando el resultado con las reglas actuales
+
+Uso:
+    python simulador_reglas.py --umbrales 0.2,0.25,0.35,0.4
+    python simulador_reglas.py --reglas candidatas.json --procesos 8
+    python simulador_reglas.py --umbrales 0.3 --club 2   # otro club (por defecto, el 1)
+
+El JSON es una lista de reglas con el mismo formato que REGLAS_PRODUCCION
+(reglas_nivel.py); las claves que falten se toman de producción.
+"""
+import argparse
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from reglas_nivel import REGLAS_PRODUCCION, variacion_y_puntos, aplicar_variacion
+
+_historial = None
+
+
+def cargar_historial(club_id=1):
+    """Lee pozos y resultados de un club y los empaqueta en arrays.
+
+    Las parejas se reconstruyen con Resultado.pareja (los dos jugadores de una
+    pareja comparten número dentro del pozo).
+    """
+    from app import app, db, con_archivo, en_club, Usuario, PozoJugado, Resultado, HistorialNivel
+
+    with app.app_context(), en_club(club_id):
+        niveles_actuales = {email.lower(): nivel for email, nivel in
+                            db.session.query(Usuario.email, Usuario.nivel_playtomic)}
+        # Nivel antes del primer cambio registrado; si nunca cambió, el actual
+        # Historial completo, incluidas las temporadas archivadas
+        Nivel, R = con_archivo(HistorialNivel, True), con_archivo(Resultado, True)
+        primer_nivel = {}
+        for email, nivel_anterior in db.session.query(Usuario.email, Nivel.nivel_anterior)\
+                .join(Nivel, Nivel.usuario_id == Usuario.id)\
+                .order_by(Nivel.fecha.desc(), Nivel.id.desc()):
+            primer_nivel[email.lower()] = nivel_anterior
+
+        filas = db.session.query(R.pozo_jugado_id, R.email, R.posicion, PozoJugado.nivel)\
+            .join(PozoJugado, R.pozo_jugado_id == PozoJugado.id)\
+            .order_by(PozoJugado.fecha, PozoJugado.id, R.pareja, R.id).all()
+
+    indices, emails, nivel_inicial, registrado = {}, [], array('d'), array('b')
+
+    def indice(email, nivel_pozo):
+        email = email.lower()
+        if email not in indices:
+            indices[email] = len(emails)
+            emails.append(email)
+            registrado.append(1 if email in niveles_actuales else 0)
+            nivel = primer_nivel.get(email, niveles_actuales.get(email))
+            nivel_inicial.append(nivel if nivel is not None else (nivel_pozo or 0))
+        return indices[email]
+
+    inicio_pozo, jugador1, jugador2, posiciones = array('i'), array('i'), array('i'), array('b')
+    pozo_actual, pendiente = None, None
+    for pozo_id, email, posicion, nivel_pozo in filas:
+        if pozo_id != pozo_actual:
+            inicio_pozo.append(len(jugador1))
+            pozo_actual, pendiente = pozo_id, None
+        if pendiente is None:
+            pendiente = (indice(email, nivel_pozo), posicion)
+            continue
+        jugador1.append(pendiente[0])
+        jugador2.append(indice(email, nivel_pozo))
+        posiciones.append(min(pendiente[1], 127) if pendiente[1] is not None else 0)
+        pendiente = None
+    inicio_pozo.append(len(jugador1))
+
+    return {
+        'emails': emails,
+        'registrado': registrado,
+        'nivel_inicial': nivel_inicial,
+        'inicio_pozo': inicio_pozo,
+        'jugador1': jugador1,
+        'jugador2': jugador2,
+        'posicion': posiciones,
+    }
+
+
+def _iniciar_proceso(historial):
+    global _historial
+    _historial = historial
+
+
+def simular(reglas):
+    """Reproduce todo el historial con unas reglas. Devuelve (niveles, puntos) finales."""
+    h = _historial
+    niveles = array('d', h['nivel_inicial'])
+    puntos = array('i', bytes(4 * len(niveles)))
+    inicio, j1, j2, pos = h['inicio_pozo'], h['jugador1'], h['jugador2'], h['posicion']
+
+    for p in range(len(inicio) - 1):
+        a, b = inicio[p], inicio[p + 1]
+        if a == b:
+            continue
+        media_pozo = sum(niveles[j1[k]] + niveles[j2[k]] for k in range(a, b)) / (2 * (b - a))
+        cambios = []
+        for k in range(a, b):
+            media_pareja = (niveles[j1[k]] + niveles[j2[k]]) / 2
+            cambios.append(variacion_y_puntos(media_pareja, media_pozo, pos[k] or None, reglas))
+        for k, (variacion, pts) in zip(range(a, b), cambios):
+            for jugador in (j1[k], j2[k]):
+                niveles[jugador] = aplicar_variacion(niveles[jugador], variacion)
+                puntos[jugador] += pts
+
+    return reglas['nombre'], niveles, puntos
+
+
+def _ranking(puntos, registrados):
+    orden = sorted(registrados, key=lambda i: (-puntos[i], i))
+    return {jugador: puesto for puesto, jugador in enumerate(orden, start=1)}, orden
+
+
+def _distribucion(niveles, registrados):
+    tramos = {}
+    for i in registrados:
+        tramo = min(int(niveles[i] * 2) / 2, 6.5)
+        tramos[tramo] = tramos.get(tramo, 0) + 1
+    return ' '.join(f'{t:.1f}:{tramos[t]}' for t in sorted(tramos))
+
+
+def informe(resultados, registrados):
+    base_niveles, base_puntos = resultados[REGLAS_PRODUCCION['nombre']]
+    base_puestos, base_orden = _ranking(base_puntos, registrados)
+    base_top10 = set(base_orden[:10])
+    n = len(registrados) or 1
+
+    print(f"\n{'Reglas':<22} {'Nivel medio':>11} {'Desv.':>6} {'Pts medios':>10} {'Pts top10%':>10} "
+          f"{'Δnivel':>7} {'Δpuesto':>8} {'Máx Δp':>7} {'Top10 =':>8}")
+    for nombre, (niveles, puntos) in resultados.items():
+        media = sum(niveles[i] for i in registrados) / n
+        desviacion = (sum((niveles[i] - media) ** 2 for i in registrados) / n) ** 0.5
+        total_puntos = sum(puntos[i] for i in registrados)
+        ordenados = sorted((puntos[i] for i in registrados), reverse=True)
+        concentracion = 100 * sum(ordenados[:max(1, n // 10)]) / total_puntos if total_puntos else 0
+        puestos, orden = _ranking(puntos, registrados)
+        delta_nivel = sum(abs(niveles[i] - base_niveles[i]) for i in registrados) / n
+        delta_puesto = [abs(puestos[i] - base_puestos[i]) for i in registrados]
+        print(f"{nombre:<22} {media:>11.2f} {desviacion:>6.2f} {total_puntos / n:>10.1f} {concentracion:>9.1f}% "
+              f"{delta_nivel:>7.3f} {sum(delta_puesto) / n:>8.2f} {max(delta_puesto, default=0):>7} "
+              f"{len(base_top10 & set(orden[:10])):>8}")
+        print(f"{'':<22} niveles: {_distribucion(niveles, registrados)}")
+
+
+def reglas_candidatas(args):
+    candidatas = []
+    if args.umbrales:
+        for umbral in args.umbrales.split(','):
+            candidatas.append(dict(REGLAS_PRODUCCION, nombre=f'umbral_{umbral}', umbral=float(umbral)))
+    if args.reglas:
+        with open(args.reglas) as f:
+            for i, reglas in enumerate(json.load(f)):
+                candidatas.append({**REGLAS_PRODUCCION, 'nombre': f'reglas_{i + 1}', **reglas})
+    return candidatas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simula reglas de nivel alternativas sobre todo el historial')
+    parser.add_argument('--reglas', help='JSON con una lista de reglas candidatas')
+    parser.add_argument('--umbrales', help='Umbrales alternativos separados por comas, p. ej. 0.2,0.4')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--club', type=int, default=1, help='Id del club cuyo historial se simula')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    historial = cargar_historial(args.club)
+    carga = time.perf_counter() - inicio
+    print(f"📦 Historial: {len(historial['inicio_pozo']) - 1} pozos, {len(historial['jugador1'])} parejas, "
+          f"{len(historial['emails'])} jugadores ({carga:.2f}s)")
+
+    candidatas = [REGLAS_PRODUCCION] + reglas_candidatas(args)
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.procesos, initializer=_iniciar_proceso,
+                             initargs=(historial,)) as pool:
+        resultados = {nombre: (niveles, puntos) for nombre, niveles, puntos in pool.map(simular, candidatas)}
+    print(f"⚙️  {len(candidatas)} simulaciones en {time.perf_counter() - inicio:.2f}s")
+
+    registrados = [i for i, r in enumerate(historial['registrado']) if r]
+    informe(resultados, registrados)
+
+
+if __name__ == '__main__':
+    main()
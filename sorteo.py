@@ -0,0 +1,124 @@
+"""
+Sorteo de parejas y pistas para un pozo
+Empareja a los jugadores para que todas las parejas tengan una media de nivel
+lo más parecida posible, respetando derecha/izquierda, y reparte las parejas
+en pistas de 4 jugadores
+"""
+
+# Coste extra (en nivel²) por juntar a dos jugadores que quieren el mismo lado
+PENALIZACION_LADO = 1.0
+
+
+def _incompatibles(a, b):
+    return a['posicion'] in ('derecha', 'izquierda') and a['posicion'] == b['posicion']
+
+
+def _asignacion_minima(costes):
+    """Algoritmo húngaro O(n³): devuelve asignacion[fila] = columna con coste total mínimo."""
+    n = len(costes)
+    infinito = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (n + 1)
+    p = [0] * (n + 1)
+    camino = [0] * (n + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minimos = [infinito] * (n + 1)
+        usados = [False] * (n + 1)
+        while True:
+            usados[j0] = True
+            i0 = p[j0]
+            delta = infinito
+            j1 = 0
+            fila = costes[i0 - 1]
+            for j in range(1, n + 1):
+                if not usados[j]:
+                    actual = fila[j - 1] - u[i0] - v[j]
+                    if actual < minimos[j]:
+                        minimos[j] = actual
+                        camino[j] = j0
+                    if minimos[j] < delta:
+                        delta = minimos[j]
+                        j1 = j
+            for j in range(n + 1):
+                if usados[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimos[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = camino[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    asignacion = [0] * n
+    for j in range(1, n + 1):
+        if p[j]:
+            asignacion[p[j] - 1] = j - 1
+    return asignacion
+
+
+def _formar_pareja(a, b):
+    # El que prefiere izquierda va a la izquierda; si ninguno lo pide, el de más nivel
+    if a['posicion'] == 'izquierda' or b['posicion'] == 'derecha':
+        izquierda, derecha = a, b
+    elif b['posicion'] == 'izquierda' or a['posicion'] == 'derecha':
+        izquierda, derecha = b, a
+    else:
+        izquierda, derecha = (a, b) if a['nivel'] >= b['nivel'] else (b, a)
+    return {
+        'derecha': derecha,
+        'izquierda': izquierda,
+        'media': round((a['nivel'] + b['nivel']) / 2, 2)
+    }
+
+
+def generar_sorteo(jugadores):
+    """Genera parejas y pistas equilibradas.
+
+    jugadores: lista de dicts con 'id', 'nombre', 'nivel' y 'posicion'
+    ('derecha', 'izquierda', 'ambos' o None), en orden de inscripción.
+    Si el número no es múltiplo de 4, los últimos inscritos quedan de reserva.
+    """
+    sobrantes = len(jugadores) % 4
+    reservas = jugadores[len(jugadores) - sobrantes:] if sobrantes else []
+    jugadores = jugadores[:len(jugadores) - sobrantes]
+    if not jugadores:
+        return {'pistas': [], 'reservas': reservas, 'desviacion': 0}
+
+    # Mitad fuerte contra mitad débil: cada fuerte se empareja con un débil
+    ordenados = sorted(jugadores, key=lambda j: j['nivel'], reverse=True)
+    mitad = len(ordenados) // 2
+    fuertes, debiles = ordenados[:mitad], ordenados[mitad:]
+    objetivo = 2 * sum(j['nivel'] for j in ordenados) / len(ordenados)
+
+    costes = [
+        [(f['nivel'] + d['nivel'] - objetivo) ** 2 + (PENALIZACION_LADO if _incompatibles(f, d) else 0)
+         for d in debiles]
+        for f in fuertes
+    ]
+    asignacion = _asignacion_minima(costes)
+    parejas = [_formar_pareja(fuertes[i], debiles[j]) for i, j in enumerate(asignacion)]
+
+    # Parejas de media parecida comparten pista; la pista 1 es la de más nivel
+    parejas.sort(key=lambda p: p['media'], reverse=True)
+    pistas = []
+    for numero, i in enumerate(range(0, len(parejas), 2), start=1):
+        pareja1, pareja2 = parejas[i], parejas[i + 1]
+        pistas.append({
+            'numero': numero,
+            'parejas': [pareja1, pareja2],
+            'media': round((pareja1['media'] + pareja2['media']) / 2, 2),
+            'diferencia': round(pareja1['media'] - pareja2['media'], 2)
+        })
+
+    medias = [p['media'] for p in pistas]
+    media_total = sum(medias) / len(medias)
+    desviacion = (sum((m - media_total) ** 2 for m in medias) / len(medias)) ** 0.5
+
+    return {'pistas': pistas, 'reservas': reservas, 'desviacion': round(desviacion, 3)}
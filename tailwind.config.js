@@ -0,0 +1,17 @@
+/** @type {import('tailwindcss').Config} */
+module.exports = {
+    darkMode: 'class',
+    content: ['./templates/**/*.html'],
+    theme: {
+        extend: {
+            colors: {
+                'primary': '#1e3a8a',
+                'secondary': '#10b981',
+                'accent': '#fbbf24',
+                'dark-bg': '#0f172a',
+                'dark-card': '#1e293b',
+                'dark-border': '#334155',
+            }
+        }
+    }
+}
@@ -0,0 +1,41 @@
+"""
+Tareas programadas de mantenimiento
+Ejecuta una vez las tareas que toquen (desactivar pozos pasados, limpiar tokens de
+recuperación caducados, reanudar envíos de avisos cortados, recalcular agregados) y termina
+
+Uso:
+    python tareas_programadas.py                  # las que estén vencidas
+    python tareas_programadas.py --forzar         # todas, aunque no toquen
+    python tareas_programadas.py limpiar_tokens   # solo las indicadas
+
+Como cron job de Render: startCommand "python tareas_programadas.py" cada 15 minutos
+y PLANIFICADOR=off en el servicio web. Usa el mismo bloqueo que el hilo de la app,
+así que aunque coincidan nunca se ejecuta dos veces la misma tarea.
+"""
+import argparse
+
+from app import app, TAREAS, TareaProgramada, ejecutar_tareas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ejecuta las tareas de mantenimiento vencidas')
+    parser.add_argument('tareas', nargs='*', help=f'Tareas a ejecutar (por defecto, todas): {", ".join(TAREAS)}')
+    parser.add_argument('--forzar', action='store_true', help='Ejecutar aunque no haya pasado el intervalo')
+    args = parser.parse_args()
+
+    desconocidas = set(args.tareas) - set(TAREAS)
+    if desconocidas:
+        parser.error(f'tareas desconocidas: {", ".join(sorted(desconocidas))}')
+
+    with app.app_context():
+        ejecutadas = ejecutar_tareas(args.tareas or None, forzar=args.forzar)
+        for tarea in TareaProgramada.query.order_by(TareaProgramada.nombre):
+            if tarea.nombre in ejecutadas:
+                print(f"✅ {tarea.nombre}: {ejecutadas[tarea.nombre]}")
+            else:
+                ultima = tarea.ultima_ejecucion.strftime('%d/%m/%Y %H:%M') if tarea.ultima_ejecucion else 'nunca'
+                print(f"⏭️  {tarea.nombre}: no tocaba o la está ejecutando otro proceso (última: {ultima})")
+
+
+if __name__ == '__main__':
+    main()